@@ -8,7 +8,14 @@ import deepl
 from streamlit_option_menu import option_menu
 from datetime import datetime
 import pytz
-from modules.modules import plot_recent_submissions, filters
+import gspread
+import hashlib
+import json
+import threading
+from contextlib import nullcontext
+from modules.modules import plot_recent_submissions, filters, with_backoff
+from modules.evaluation_cache import get_evaluation_cache
+from modules.transcription import transcribe_audio
 
 
 #Secret keys
@@ -20,6 +27,14 @@ toefl_speaking = st.secrets.toefl_speaking
 general_writing = st.secrets.general_writing
 deepl_api = st.secrets.deepl
 
+# Identical submissions within this many seconds are recorded once
+SUBMISSION_DEDUP_SECONDS = 600
+# Submissions are checked for new rows this often, and fully re-read this often to pick up edits
+SUBMISSION_SYNC_SECONDS = 5
+SUBMISSION_FULL_RELOAD_SECONDS = 3600
+SUBMISSION_COLUMNS = 7
+SUBMISSIONS_CACHE_PATH = "submissions_cache.parquet"
+
 #Initialize OpenAI client and set default assistant_id
 client = OpenAI(api_key=api)
 a_id = "null"
@@ -156,14 +171,30 @@ def get_GPT_response(option, grade, style, txt, return_content=False):
         st.markdown("Please Provide Your Answer First")
 
     if assistant_id != "null":
-        evaluation = run_assistant(assistant_id, txt, return_content=True)
+        # The same answer to the same assistant gets the stored evaluation instead of a new run
+        test_framework = f"{option}{grade}" if option in ["Eiken", "英検"] else option
+        cache = get_evaluation_cache()
+        cache_key = cache.key(assistant_id, test_framework, style, txt)
+        evaluation = cache.get(cache_key)
+        if evaluation is not None:
+            with st.chat_message("user"):
+                st.write(txt)
+            with st.chat_message("assistant"):
+                st.write(evaluation)
+        else:
+            evaluation = run_assistant(assistant_id, txt, return_content=True)
+            if evaluation:
+                cache.set(cache_key, evaluation)
 
     if return_content:
         return assistant_id, evaluation
     else:
         return assistant_id, None
 
-def run_assistant(assistant_id, txt, return_content=False, display_chat=True):
+# Run states after which the run will not change any more
+FINISHED_RUN_STATUSES = ('completed', 'failed', 'cancelled', 'expired', 'incomplete', 'requires_action')
+
+def run_assistant(assistant_id, txt, return_content=False, display_chat=True, stream=True):
     if 'client' not in st.session_state:
         st.session_state.client = OpenAI(api_key=api)
 
@@ -171,6 +202,7 @@ def run_assistant(assistant_id, txt, return_content=False, display_chat=True):
         st.session_state.assistant = st.session_state.client.beta.assistants.retrieve(assistant_id)
         #Create a thread 
         st.session_state.thread = st.session_state.client.beta.threads.create()
+    content = None
     if txt:
         #Add a Message to a Thread
         message = st.session_state.client.beta.threads.messages.create(
@@ -179,41 +211,82 @@ def run_assistant(assistant_id, txt, return_content=False, display_chat=True):
             content = txt
         )
 
-        #Run the Assistant
-        run = st.session_state.client.beta.threads.runs.create(
-                thread_id=st.session_state.thread.id,
-                assistant_id=st.session_state.assistant.id
-        )
-
-        # Spinner for ongoing process
-        with st.spinner('Neurons weaving through the layers ...'):
-            while True:
-                # Retrieve the run status
-                run_status = st.session_state.client.beta.threads.runs.retrieve(
-                    thread_id=st.session_state.thread.id,
-                    run_id=run.id
-                )
-
-                # If run is completed, process messages
-                if run_status.status == 'completed':
-                    messages = st.session_state.client.beta.threads.messages.list(
-                        thread_id=st.session_state.thread.id
-                    )
-
-                    # Loop through messages and print content based on role
-                    for msg in reversed(messages.data):
-                        role = msg.role
-                        content = msg.content[0].text.value
-                        
-                        # Use st.chat_message to display the message based on the role
-                        if display_chat:
-                            with st.chat_message(role):
-                                st.write(content)
-                    break
-                # Wait for a short time before checking the status again
-                time.sleep(1)
+        # Stream the feedback as it is written; older openai packages only support polling
+        if stream and hasattr(st.session_state.client.beta.threads.runs, 'stream'):
+            content = stream_run(txt, display_chat)
+        else:
+            content = poll_run(display_chat)
     if return_content:
         return content
+
+def stream_run(txt, display_chat):
+    if display_chat:
+        with st.chat_message("user"):
+            st.write(txt)
+        feedback = st.chat_message("assistant").empty()
+        feedback.write('Neurons weaving through the layers ...')
+
+    text = ''
+    # Without a chat to stream into, show the spinner the polling version had
+    with nullcontext() if display_chat else st.spinner('Neurons weaving through the layers ...'):
+        with st.session_state.client.beta.threads.runs.stream(
+            thread_id=st.session_state.thread.id,
+            assistant_id=st.session_state.assistant.id
+        ) as stream:
+            for delta in stream.text_deltas:
+                text += delta
+                if display_chat:
+                    feedback.markdown(text + '▌')
+            run = stream.get_final_run()
+
+    if run.status != 'completed':
+        if display_chat:
+            feedback.empty()
+        show_run_error(run)
+        return None
+    if display_chat:
+        feedback.markdown(text)
+    return text
+
+def poll_run(display_chat):
+    #Run the Assistant
+    run = st.session_state.client.beta.threads.runs.create(
+            thread_id=st.session_state.thread.id,
+            assistant_id=st.session_state.assistant.id
+    )
+
+    # Spinner for ongoing process
+    with st.spinner('Neurons weaving through the layers ...'):
+        while run.status not in FINISHED_RUN_STATUSES:
+            # Wait for a short time before checking the status again
+            time.sleep(0.5)
+            run = st.session_state.client.beta.threads.runs.retrieve(
+                thread_id=st.session_state.thread.id,
+                run_id=run.id
+            )
+
+    if run.status != 'completed':
+        show_run_error(run)
+        return None
+
+    messages = st.session_state.client.beta.threads.messages.list(
+        thread_id=st.session_state.thread.id
+    )
+    content = None
+    # Loop through messages and print content based on role
+    for msg in reversed(messages.data):
+        role = msg.role
+        content = msg.content[0].text.value
+
+        # Use st.chat_message to display the message based on the role
+        if display_chat:
+            with st.chat_message(role):
+                st.write(content)
+    return content
+
+def show_run_error(run):
+    reason = run.last_error.message if getattr(run, 'last_error', None) else run.status
+    st.error(f"The evaluation could not be completed ({reason}). Please try again.")
     
 @st.cache_resource(ttl="1d")
 def establish_gsheets_connection():
@@ -228,10 +301,108 @@ def establish_gsheets_connection():
     return conn
 
 def fetch_latest_data(conn):
-    # Use the cached connection to fetch the latest data
-    latest_data = conn.read(worksheet="シート1", usecols=list(range(7)), ttl=5)
-    latest_data = latest_data.dropna(how="all")
-    return latest_data
+    # Submissions shared by every session; only rows added since the last sync are downloaded.
+    # conn is kept for the callers, the rows are read through the gspread worksheet.
+    store, lock = submission_store()
+    with lock:
+        if store["data"] is None or time.time() - store["synced_at"] > SUBMISSION_SYNC_SECONDS:
+            sync_submissions(store)
+        return store["data"].copy()
+
+@st.cache_resource
+def submission_store():
+    store = {"data": None, "sheet_rows": 0, "last_row": None, "synced_at": 0.0, "full_at": 0.0}
+    load_local_submissions(store)
+    return store, threading.Lock()
+
+def submission_columns(header):
+    # First 7 columns, named like conn.read names them
+    return [name or f"Unnamed: {i}" for i, name in enumerate(pad_submission_row(header))]
+
+def pad_submission_row(row):
+    return (list(row) + [""] * SUBMISSION_COLUMNS)[:SUBMISSION_COLUMNS]
+
+def submissions_frame(rows, columns, like=None):
+    # Rows appended to a frame we already hold take its column types; None if a value doesn't fit
+    frame = pd.DataFrame(rows, columns=columns)
+    frame = frame.mask(frame == "").dropna(how="all")
+    if like is None:
+        return infer_submission_types(frame)
+    for column in frame.columns:
+        if column in like.columns and pd.api.types.is_numeric_dtype(like[column]):
+            try:
+                frame[column] = pd.to_numeric(frame[column])
+            except (ValueError, TypeError):
+                return None
+    return frame
+
+def infer_submission_types(frame):
+    # gspread returns every cell as a string; convert the columns conn.read (read_csv) would
+    # have read as numbers, e.g. the score that display_progression_graph averages
+    for column in frame.columns:
+        if not pd.api.types.is_numeric_dtype(frame[column]):
+            try:
+                frame[column] = pd.to_numeric(frame[column])
+            except (ValueError, TypeError):
+                pass
+    return frame
+
+def sync_submissions(store):
+    worksheet, header = open_submission_worksheet()
+    columns = submission_columns(header)
+    if store["data"] is None or time.time() - store["full_at"] > SUBMISSION_FULL_RELOAD_SECONDS:
+        reload_submissions(store, worksheet, columns)
+        return
+
+    # Read from the last row we already have, to notice rows that were edited or removed
+    first_row = store["sheet_rows"] + 1 if store["sheet_rows"] else 2  # Row 1 is the header
+    rows = [pad_submission_row(row) for row in worksheet.get(f"A{first_row}:G")]
+    if store["sheet_rows"]:
+        if not rows or rows[0] != store["last_row"]:
+            reload_submissions(store, worksheet, columns)
+            return
+        rows = rows[1:]
+    if rows:
+        new_rows = submissions_frame(rows, columns, like=store["data"])
+        if new_rows is None:
+            # e.g. text in a column that was all numbers: read it all, as conn.read would type it
+            reload_submissions(store, worksheet, columns)
+            return
+        store["data"] = pd.concat([store["data"], new_rows], ignore_index=True)
+        store["sheet_rows"] += len(rows)
+        store["last_row"] = rows[-1]
+        save_local_submissions(store)
+    store["synced_at"] = time.time()
+
+def reload_submissions(store, worksheet, columns):
+    rows = [pad_submission_row(row) for row in worksheet.get_all_values()[1:]]
+    now = time.time()
+    store.update(
+        data=submissions_frame(rows, columns),
+        sheet_rows=len(rows),
+        last_row=rows[-1] if rows else None,
+        synced_at=now,
+        full_at=now
+    )
+    save_local_submissions(store)
+
+def save_local_submissions(store):
+    # Parquet copy so a restarted app only downloads the rows added meanwhile
+    try:
+        store["data"].to_parquet(SUBMISSIONS_CACHE_PATH, index=False)
+        with open(SUBMISSIONS_CACHE_PATH + ".json", "w") as meta:
+            json.dump({key: store[key] for key in ("sheet_rows", "last_row", "full_at")}, meta)
+    except Exception as e:  # Best effort: e.g. pyarrow's ArrowTypeError is a TypeError
+        print("Could not save the local submission copy:", e)
+
+def load_local_submissions(store):
+    try:
+        data = infer_submission_types(pd.read_parquet(SUBMISSIONS_CACHE_PATH))
+        with open(SUBMISSIONS_CACHE_PATH + ".json") as meta:
+            store.update(json.load(meta))
+        store["data"] = data
+    except (ImportError, OSError, ValueError):
+        pass  # No usable copy: the first sync reads the whole sheet
 
 def add_new_data(email, option, grade, style, user_input, evaluation):
     # Concatenate option and grade if Eiken/英検 is selected
@@ -256,10 +427,55 @@ def add_new_data(email, option, grade, style, user_input, evaluation):
     )
     return new_data
 
-def update_google_sheets(conn, existing_data, new_data):
-    # Update a Google Sheets
-    updated_df = pd.concat([existing_data, new_data.to_frame().T], ignore_index=True)
-    conn.update(worksheet="シート1", data=updated_df)
+@st.cache_resource
+def open_submission_worksheet():
+    # gspread worksheet built from the same secrets as the "gsheets" connection, so a
+    # submission can be appended as one row instead of re-uploading the whole sheet
+    config = dict(st.secrets.connections.gsheets)
+    spreadsheet = config.pop("spreadsheet")
+    config.pop("worksheet", None)
+    client = gspread.service_account_from_dict(config)
+    if spreadsheet.startswith("https://"):
+        workbook = client.open_by_url(spreadsheet)
+    else:
+        workbook = client.open(spreadsheet)
+    worksheet = workbook.worksheet("シート1")
+    header = worksheet.row_values(1)  # Column order of the sheet, read once per process
+    return worksheet, header
+
+@st.cache_resource
+def recent_submission_keys():
+    # Shared by every session in the process: idempotency key -> time it was written
+    return {}, threading.Lock()
+
+def submission_key(new_data):
+    # The evaluation is left out: a double-click or rerun starts a new run, whose feedback text differs
+    fields = ("user_email", "test_framework", "test_section", "user_input")
+    return hashlib.sha256("\x1f".join(str(new_data[field]) for field in fields).encode("utf-8")).hexdigest()
+
+def append_submission(new_data):
+    # Appends only the new row; concurrent students each add their own row and cannot overwrite others
+    seen, lock = recent_submission_keys()
+    key = submission_key(new_data)
+    with lock:
+        now = time.monotonic()
+        for old_key in [k for k, written_at in seen.items() if now - written_at > SUBMISSION_DEDUP_SECONDS]:
+            del seen[old_key]
+        if key in seen:
+            return False  # The same evaluation was already recorded (e.g. a double click)
+        seen[key] = now
+
+    worksheet, header = open_submission_worksheet()
+    row = [str(new_data.get(column, "")) for column in header]
+    try:
+        # Only quota errors are retried: a retried append after a 5xx could add the row twice
+        with_backoff(lambda: worksheet.append_row(row, value_input_option="USER_ENTERED", table_range="A1"),
+                     statuses=(429,))
+    except Exception:
+        with lock:
+            seen.pop(key, None)  # Let the student submit again
+        raise
+    return True
 
 def no_input_error(is_japanese):
     st.error(translate("先に回答をしてください", 
@@ -453,11 +669,7 @@ def main():
                         if user_input:
                             if style == "Speaking":
                                 # Transcribe audio
-                                user_input = client.audio.transcriptions.create(
-                                    model="whisper-1",
-                                    file=user_input,
-                                    response_format="text"
-                                )
+                                user_input = transcribe_audio(client, user_input.getvalue(), user_input.name)
                             #reset the thread
                             if 'client' in st.session_state:
                                 del st.session_state.client
@@ -468,10 +680,10 @@ def main():
                             # Store the evaluation in session state after generating it
                             st.session_state.evaluation = evaluation
 
-                            # Add new data and update Google Sheets
-                            new_data = add_new_data(st.session_state.email, option, grade, style, user_input, evaluation)
-                            existing_data = fetch_latest_data(conn)
-                            update_google_sheets(conn, existing_data, new_data)
+                            # Add new data and update Google Sheets; failed runs are not recorded
+                            if evaluation:
+                                new_data = add_new_data(st.session_state.email, option, grade, style, user_input, evaluation)
+                                append_submission(new_data)
                         else:
                             no_input_error(JP)
 
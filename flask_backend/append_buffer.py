@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class AppendBuffer:
+    """Write-behind buffer that turns single-row appends into one multi-row append."""
+
+    def __init__(self, write_rows, max_delay=0.3, max_rows=50, journal_path=None,
+                 is_permanent=None, dead_letter_path=None, on_dead_letter=None, max_backoff=60.0):
+        # write_rows(spreadsheet_id, range_name, rows) performs the real append
+        self._write_rows = write_rows
+        self._max_delay = max_delay
+        self._max_rows = max_rows
+        self._journal_path = journal_path
+        # Rows whose append fails with is_permanent(error) are moved to the dead-letter file
+        # instead of being retried; on_dead_letter(spreadsheet_id, range_name, rows) is told about them
+        self._is_permanent = is_permanent or (lambda error: False)
+        self._dead_letter_path = dead_letter_path
+        self._on_dead_letter = on_dead_letter
+        self._max_backoff = max_backoff
+        self._pending = []  # [(spreadsheet_id, range_name, row), ...] in arrival order
+        self._lock = threading.Condition()
+        self._flush_lock = threading.RLock()  # only one flush at a time keeps rows in order
+        self._thread = None
+        self._failures = 0  # Failed flushes in a row
+        self._retry_at = 0  # No flush is attempted before this time.monotonic() value
+        self.dead_lettered = 0
+        self._replay_journal()
+
+    def _replay_journal(self):
+        # Rows acknowledged before a crash are still in the journal, send them first
+        if self._journal_path and os.path.exists(self._journal_path):
+            with open(self._journal_path, encoding='utf-8') as journal:
+                for line in journal:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._pending.append((entry['spreadsheet_id'], entry['range_name'], entry['row']))
+
+    def _write_journal(self, entries, mode):
+        if not self._journal_path:
+            return
+        with open(self._journal_path, mode, encoding='utf-8') as journal:
+            for spreadsheet_id, range_name, row in entries:
+                journal.write(json.dumps({'spreadsheet_id': spreadsheet_id, 'range_name': range_name, 'row': row}, ensure_ascii=False) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def _dead_letter(self, spreadsheet_id, range_name, rows, error):
+        print(f"Dropping {len(rows)} row(s) for {range_name} that the sheet rejected:", error)
+        self.dead_lettered += len(rows)
+        if self._dead_letter_path:
+            with open(self._dead_letter_path, 'a', encoding='utf-8') as dead_letters:
+                for row in rows:
+                    dead_letters.write(json.dumps({'spreadsheet_id': spreadsheet_id, 'range_name': range_name, 'row': row, 'error': str(error)}, ensure_ascii=False) + '\n')
+
+    def _start(self):
+        # Started on first use so the thread is created after gunicorn forks
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending:
+                    self._lock.wait()
+                # Give other rows a short time to arrive, unless the batch is already full
+                deadline = time.monotonic() + self._max_delay
+                while len(self._pending) < self._max_rows and time.monotonic() < deadline:
+                    self._lock.wait(deadline - time.monotonic())
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Append flush failed, retrying in {self._retry_at - time.monotonic():.1f}s:", e)
+            # After a failure, wait out the backoff instead of trying again on every loop
+            time.sleep(max(0.0, self._retry_at - time.monotonic()))
+
+    def add(self, spreadsheet_id, range_name, row):
+        if self._max_delay <= 0:
+            self._write_rows(spreadsheet_id, range_name, [row])
+            return
+        with self._lock:
+            self._write_journal([(spreadsheet_id, range_name, row)], 'a')
+            self._pending.append((spreadsheet_id, range_name, row))
+            self._start()
+            self._lock.notify_all()
+
+    def flush(self, spreadsheet_id=None, force=False):
+        """Writes pending rows (of one spreadsheet, or all) in order, one append per run of rows.
+
+        After a failed flush nothing is written until the backoff has passed, unless force is set.
+        """
+        dead_letters = []  # (spreadsheet_id, range_name, rows) dropped by this flush
+        try:
+            self._flush(spreadsheet_id, force, dead_letters)
+        finally:
+            # Told only once _flush_lock is released: on_dead_letter may take locks (e.g. a store's)
+            # whose holders can be waiting for a flush themselves
+            if self._on_dead_letter:
+                for dead_letter in dead_letters:
+                    self._on_dead_letter(*dead_letter)
+
+    def _flush(self, spreadsheet_id, force, dead_letters):
+        with self._flush_lock:
+            with self._lock:
+                if not force and time.monotonic() < self._retry_at:
+                    return
+                taken = [entry for entry in self._pending if spreadsheet_id in (None, entry[0])]
+                if not taken:
+                    return
+                self._pending = [entry for entry in self._pending if spreadsheet_id not in (None, entry[0])]
+
+            # Consecutive rows for the same spreadsheet and range become one append
+            try:
+                start = 0
+                while start < len(taken):
+                    end = start
+                    while end < len(taken) and taken[end][:2] == taken[start][:2]:
+                        end += 1
+                    rows = [entry[2] for entry in taken[start:end]]
+                    try:
+                        self._write_rows(taken[start][0], taken[start][1], rows)
+                    except Exception as e:
+                        if not self._is_permanent(e):
+                            raise
+                        self._dead_letter(taken[start][0], taken[start][1], rows, e)
+                        dead_letters.append((taken[start][0], taken[start][1], rows))
+                    start = end
+            except Exception:
+                # Keep the unwritten rows at the front so the order is preserved on retry
+                with self._lock:
+                    self._pending = taken[start:] + self._pending
+                    self._failures += 1
+                    self._retry_at = time.monotonic() + min(self._max_backoff, self._max_delay * 2 ** self._failures)
+                    self._write_journal(self._pending, 'w')
+                raise
+
+            with self._lock:
+                self._failures = 0
+                self._retry_at = 0
+                self._write_journal(self._pending, 'w')
+
+    @contextmanager
+    def paused(self):
+        # Nothing is written by other threads inside this block, e.g. between reading a sheet
+        # and adding its pending_rows; flushes from this thread still go ahead
+        with self._flush_lock:
+            yield
+
+    def pending_rows(self, spreadsheet_id):
+        """Rows queued for spreadsheet_id but not written yet, in order."""
+        with self._lock:
+            return [row for entry_spreadsheet_id, _, row in self._pending if entry_spreadsheet_id == spreadsheet_id]
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
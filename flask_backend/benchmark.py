@@ -0,0 +1,359 @@
+# Offline benchmarks for the backend, run with: python benchmark.py [--sizes 1000 10000 100000]
+# The Sheets service and the OpenAI client are replaced by in-memory fakes, so no network is used.
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import parse_range
+from word_store import WordStore
+
+
+def make_word_rows(total_rows, words_per_user=50):
+    rows = []
+    user_ids = [''.join(random.choices(string.ascii_letters, k=8)) for _ in range(max(1, total_rows // words_per_user))]
+    for i in range(total_rows):
+        rows.append(['', user_ids[i % len(user_ids)], f'word{i}', f'/wɜːd{i}/', f'definition of word{i}',
+                     f'1. a{i}\n2. b{i}\n3. c{i}', f'1. An example of word{i}.\n2. Another one.\n3. A third one.'])
+    return rows, user_ids
+
+
+def bench_word_store(sizes=(1_000, 10_000, 100_000), lookups=1_000):
+    # Per-user lookup latency should stay flat while the sheet grows
+    for size in sizes:
+        rows, user_ids = make_word_rows(size)
+        store = WordStore(lambda: rows)
+        store.reload()
+        start = time.perf_counter()
+        for _ in range(lookups):
+            store.user_rows(random.choice(user_ids))
+        elapsed = time.perf_counter() - start
+        print(f"word_store rows={size:>7}  {elapsed / lookups * 1e6:8.1f} us/lookup")
+
+
+def list_rows_with_index(rows):
+    # How the rows used to be kept: a list of cells per row plus the user_id index
+    rows = [list(row) for row in rows]
+    by_user = {}
+    for index, row in enumerate(rows):
+        by_user.setdefault(row[1], []).append(index)
+    return rows, by_user
+
+
+def loaded_store(load_rows):
+    store = WordStore(load_rows)
+    store.reload()
+    return store
+
+
+def traced_bytes(build):
+    tracemalloc.start()
+    kept = build()  # noqa: F841, held so its memory is still traced below
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return used
+
+
+def bench_memory(sizes=(1_000, 10_000, 100_000), vocabulary=5_000):
+    # Heap kept by the cached word sheet, starting from the JSON the Sheets API returns
+    results = {}
+    for size in sizes:
+        rows, _ = make_word_rows(size)
+        for index, row in enumerate(rows):
+            row[2] = f'word{index % vocabulary}'  # Students of a class look up many of the same words
+        payload = json.dumps({'values': rows})
+
+        lists_bytes = traced_bytes(lambda: list_rows_with_index(json.loads(payload)['values']))
+        store_bytes = traced_bytes(lambda: loaded_store(lambda: json.loads(payload)['values']))
+        results[size] = {'list_rows_mb': lists_bytes / 2**20, 'word_store_mb': store_bytes / 2**20}
+        print(f"memory    rows={size:>7}  lists={lists_bytes / 2**20:8.2f} MB  word_store={store_bytes / 2**20:8.2f} MB")
+    return results
+
+
+# ----------------- FAKE SERVICES -------------------
+
+class FakeRequest:
+    def __init__(self, run, latency):
+        self._run = run
+        self._latency = latency
+
+    def execute(self, **kwargs):
+        if self._latency:
+            time.sleep(self._latency)
+        return self._run()
+
+
+class FakeSheetsService:
+    """Just enough of the Sheets v4 API for sheet_operation, backed by lists of rows."""
+
+    def __init__(self, latency=0.0):
+        self.sheets = {}  # spreadsheet_id -> rows
+        self.latency = latency
+        self.calls = 0
+
+    def _request(self, run):
+        self.calls += 1
+        return FakeRequest(run, self.latency)
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, range):
+        def run():
+            _, first_col, first_row, last_col, last_row = parse_range(range)
+            rows = self.sheets.setdefault(spreadsheetId, [])
+            values = [row[first_col:last_col + 1] for row in rows[first_row - 1:last_row]]
+            while values and not values[-1]:
+                values.pop()
+            return {'values': values} if values else {}
+        return self._request(run)
+
+    def batchGet(self, spreadsheetId, ranges):
+        requests = [self.get(spreadsheetId, range_name) for range_name in ranges]
+        self.calls -= len(requests) - 1  # One API call for all ranges
+        return FakeRequest(lambda: {'valueRanges': [request._run() for request in requests]}, self.latency)
+
+    def append(self, spreadsheetId, range, valueInputOption, body):
+        def run():
+            self.sheets.setdefault(spreadsheetId, []).extend(list(row) for row in body['values'])
+            return {}
+        return self._request(run)
+
+    def _write(self, spreadsheet_id, range_name, values):
+        _, first_col, first_row, _, _ = parse_range(range_name)
+        rows = self.sheets.setdefault(spreadsheet_id, [])
+        for offset, new_values in enumerate(values):
+            while len(rows) < first_row + offset:
+                rows.append([])
+            row = rows[first_row + offset - 1]
+            if len(row) < first_col + len(new_values):
+                row.extend([''] * (first_col + len(new_values) - len(row)))
+            row[first_col:first_col + len(new_values)] = new_values
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        return self._request(lambda: self._write(spreadsheetId, range, body['values']) or {})
+
+    def batchUpdate(self, spreadsheetId, body):
+        def run():
+            if 'data' in body:  # values().batchUpdate
+                for item in body['data']:
+                    self._write(spreadsheetId, item['range'], item['values'])
+            for request in body.get('requests', []):  # spreadsheets().batchUpdate
+                deleted = request['deleteDimension']['range']
+                del self.sheets[spreadsheetId][deleted['startIndex']:deleted['endIndex']]
+            return {'spreadsheetId': spreadsheetId}
+        return self._request(run)
+
+
+class FakeOpenAI:
+    """Answers table_content prompts after a configurable delay."""
+
+    def __init__(self, latency=0.5):
+        self.latency = latency
+        self.calls = 0
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    @staticmethod
+    def _content(word):
+        return {
+            "word": word,
+            "pronunciation": f"/{word}/",
+            "definition": f"definition of {word}",
+            "synonyms": ["one", "two", "three"],
+            "examples": [f"An example with {word}."] * 3
+        }
+
+    def create(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        prompt = kwargs['messages'][-1]['content']
+        if 'following words' in prompt:
+            words = json.loads(prompt[prompt.index('['):])
+            content = {"words": [self._content(word) for word in words]}
+        else:
+            content = self._content(re.search(r"for the word '(.*)' in JSON", prompt).group(1))
+        message = types.SimpleNamespace(content=json.dumps(content))
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+# ----------------- ROUTE BENCHMARK -------------------
+
+def load_backend(workdir, sheets_latency, llm_latency):
+    # Configure the backend for offline use before it is imported
+    os.environ.update({
+        'GOOGLE_SHEETS_CREDENTIALS_FILE': base64.b64encode(b'{}').decode(),
+        'SPREADSHEET_ID': 'words',
+        'USERSHEET_ID': 'users',
+        'openai_api': 'offline',
+        'STORAGE_BACKEND': 'sheets',
+        'WARMUP_ON_START': '0',
+        'ENRICHMENT_CACHE_PATH': os.path.join(workdir, 'enrichment_cache.db'),
+        'APPEND_JOURNAL_PATH': os.path.join(workdir, 'append_journal.jsonl'),
+        'APPEND_DEAD_LETTER_PATH': os.path.join(workdir, 'append_dead_letter.jsonl'),
+        'SHEETS_READS_PER_MINUTE': '1000000',
+        'SHEETS_WRITES_PER_MINUTE': '1000000',
+    })
+    import flask_backend
+    service = FakeSheetsService(latency=sheets_latency)
+    flask_backend.storage._create_service = lambda: service
+    flask_backend.client = FakeOpenAI(latency=llm_latency)
+    return flask_backend, service
+
+
+def seed(backend, service, total_rows, class_size=40):
+    rows, user_ids = make_word_rows(total_rows)
+    # Leave every tenth word of each student without content for fill_missing_content
+    for index, row in enumerate(rows):
+        if (index // len(user_ids)) % 10 == 0:
+            del row[3:]
+    service.sheets['words'] = rows
+    service.sheets['users'] = [[f'{user_id}@example.com', '', user_id, f'nick_{user_id}'] for user_id in user_ids]
+    backend.word_store.reload()
+    backend.user_directory.reload()
+    emails = [row[0] for row in service.sheets['users'][:class_size]]
+    return user_ids, emails
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def drive(test_client, name, make_request, count):
+    latencies = []
+    start = time.perf_counter()
+    for i in range(count):
+        request_start = time.perf_counter()
+        response = make_request(test_client, i)
+        latencies.append(time.perf_counter() - request_start)
+        if response.status_code >= 500:
+            raise RuntimeError(f'{name} failed with {response.status_code}')
+    elapsed = time.perf_counter() - start
+    return {
+        'requests': count,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'throughput_rps': count / elapsed if elapsed else 0.0
+    }
+
+
+def bench_routes(backend, service, total_rows, count):
+    user_ids, emails = seed(backend, service, total_rows)
+    test_client = backend.app.test_client()
+    added = []
+
+    def add_word(c, i):
+        user_id = random.choice(user_ids)
+        added.append((user_id, f'bench{i}'))
+        return c.post('/add_word', json={'user_id': user_id, 'word': f'bench{i}'})
+
+    def delete_word(c, i):
+        user_id, word = added[i % len(added)]
+        return c.post('/delete_word', json={'user_id': user_id, 'word': word})
+
+    routes = [
+        ('/get_words', lambda c, i: c.get('/get_words', query_string={'user_id': random.choice(user_ids)})),
+        ('/add_word', add_word),
+        ('/delete_word', delete_word),
+        ('/fill_missing_content', lambda c, i: c.post('/fill_missing_content', json={'user_id': user_ids[i % len(user_ids)]})),
+        ('/get_nicknames_and_ids', lambda c, i: c.post('/get_nicknames_and_ids', json={'emails': emails})),
+    ]
+    results = {}
+    for name, make_request in routes:
+        with contextlib.redirect_stdout(io.StringIO()):  # Keep the backend's request logging out of the report
+            results[name] = drive(test_client, name, make_request, count)
+        if name == '/add_word':
+            # Let the background enrichment finish so it does not slow the next route
+            while backend.enrichment_jobs.depth():
+                time.sleep(0.05)
+    return results
+
+
+def bench_threads(backend, service, thread_counts, count, sheets_latency, total_rows=1_000):
+    # Sheets-bound requests served the way gunicorn --threads does, one thread per request
+    user_ids, _ = seed(backend, service, total_rows)
+    previous_latency, service.latency = service.latency, sheets_latency
+
+    def update_nickname(i):
+        # A client per request, like separate students
+        response = backend.app.test_client().post('/update_nickname', json={'user_id': user_ids[i % len(user_ids)], 'nickname': f'nick{i}'})
+        if response.status_code >= 500:
+            raise RuntimeError(f'/update_nickname failed with {response.status_code}')
+
+    results = {}
+    for threads in thread_counts:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(update_nickname, range(count)))
+        elapsed = time.perf_counter() - start
+        results[threads] = {'requests': count, 'throughput_rps': count / elapsed}
+        print(f"threads={threads:>3}  /update_nickname        {count / elapsed:8.1f} req/s  "
+              f"({backend.storage.services_created} Sheets clients built)")
+    service.latency = previous_latency
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the backend routes')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000], help='word sheet row counts')
+    parser.add_argument('--requests', type=int, default=50, help='requests per route and size')
+    parser.add_argument('--llm-latency', type=float, default=0.2, help='seconds per fake OpenAI call')
+    parser.add_argument('--sheets-latency', type=float, default=0.0, help='seconds per fake Sheets call')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8], help='thread counts for the load test')
+    parser.add_argument('--thread-latency', type=float, default=0.05, help='seconds per fake Sheets call in the load test')
+    parser.add_argument('--output', default='benchmark_results.json', help='where to write the JSON results')
+    args = parser.parse_args()
+
+    bench_word_store(args.sizes)
+    memory = bench_memory(args.sizes)
+
+    workdir = tempfile.mkdtemp(prefix='wernicke-bench-')
+    backend, service = load_backend(workdir, args.sheets_latency, args.llm_latency)
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'settings': vars(args),
+        'memory': {str(size): result for size, result in memory.items()},
+        'results': {}
+    }
+    for size in args.sizes:
+        results = bench_routes(backend, service, size, args.requests)
+        report['results'][str(size)] = results
+        for route, result in results.items():
+            print(f"rows={size:>7}  {route:<24} p50={result['p50_ms']:8.2f}ms  p95={result['p95_ms']:8.2f}ms  "
+                  f"{result['throughput_rps']:8.1f} req/s")
+    report['threads'] = {
+        str(threads): result
+        for threads, result in bench_threads(backend, service, args.threads, args.requests, args.thread_latency).items()
+    }
+
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print("Results written to", args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+
+
+def normalize_word(word):
+    # "  Apple ", "apple" and "APPLE" share one cache entry
+    return re.sub(r'\s+', ' ', word).strip().lower()
+
+
+class EnrichmentCache:
+    """Word content from table_content, kept on disk and shared by every student."""
+
+    def __init__(self, path, max_entries=50000):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS word_content ("
+            "key TEXT PRIMARY KEY, word TEXT, content TEXT, last_used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS word_content_last_used ON word_content (last_used)")
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(word):
+        return hashlib.sha256(normalize_word(word).encode('utf-8')).hexdigest()
+
+    def get(self, word):
+        key = self.key(word)
+        with self._lock:
+            row = self._conn.execute("SELECT content FROM word_content WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE word_content SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, word, content):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO word_content (key, word, content, last_used) VALUES (?, ?, ?, ?)",
+                (self.key(word), normalize_word(word), json.dumps(content), time.time())
+            )
+            # Evict the least recently used words once the cache is full
+            self._conn.execute(
+                "DELETE FROM word_content WHERE key IN ("
+                "SELECT key FROM word_content ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self._max_entries,)
+            )
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM word_content").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'max_entries': self._max_entries
+        }
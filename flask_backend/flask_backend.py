@@ -1,14 +1,35 @@
-from flask import Flask, request, jsonify
+import time
+STARTED_AT = time.perf_counter()  # Measures the cold start, including the imports below
+
+from flask import Flask, request, jsonify, g, has_request_context
 from flask_cors import CORS
 from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
+import httplib2
 from openai import OpenAI
 import os
 import base64
 import json
 import random
 import string
+import atexit
+import threading
+from contextlib import nullcontext
+from functools import lru_cache
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from word_store import WordStore, TIMESTAMP_FORMAT
+from user_directory import UserDirectory
+from enrichment_cache import EnrichmentCache, normalize_word
+from jobs import JobQueue
+from storage import SheetsStorage, SQLiteStorage
+from append_buffer import AppendBuffer
+from metrics import Registry, ROW_BUCKETS
+from sheets_scheduler import SheetsScheduler, is_permanent_error
+from single_flight import SingleFlight, KeyedLocks
+from responses import json_response
 
 client = OpenAI(api_key=os.environ.get('openai_api'))
 
@@ -17,6 +38,27 @@ client = OpenAI(api_key=os.environ.get('openai_api'))
 app = Flask(__name__)
 CORS(app)
 
+# Prometheus metrics served on /metrics
+metrics = Registry()
+request_seconds = metrics.histogram('wernicke_http_request_duration_seconds', 'Time spent handling each request, by route.')
+requests_total = metrics.counter('wernicke_http_requests_total', 'Requests handled, by route and status code.')
+errors_total = metrics.counter('wernicke_http_errors_total', 'Requests that ended with a 5xx status, by route.')
+rows_scanned = metrics.histogram('wernicke_rows_scanned', 'Sheet or index rows looked at per request, by route.', buckets=ROW_BUCKETS)
+sheet_operation_seconds = metrics.histogram('wernicke_sheet_operation_duration_seconds', 'Time spent in sheet_operation, by operation.')
+openai_seconds = metrics.histogram('wernicke_openai_request_duration_seconds', 'Time spent waiting for OpenAI word content, by kind.')
+cache_lookups = metrics.counter('wernicke_enrichment_cache_lookups_total', 'Enrichment cache lookups since start, by result.')
+queue_depth = metrics.gauge('wernicke_queue_depth', 'Items waiting in background queues, by queue.')
+sheets_retries = metrics.counter('wernicke_sheets_retries_total', 'Sheets requests retried after a 429/5xx since start.')
+sheets_throttled = metrics.counter('wernicke_sheets_throttled_total', 'Sheets requests that had to wait for quota since start.')
+sheets_clients = metrics.counter('wernicke_sheets_clients_created_total', 'Sheets API clients built so far, one per thread that used the API.')
+single_flight_shared = metrics.counter('wernicke_single_flight_shared_total', 'Requests answered with the result of an identical request already running.')
+append_dead_letters = metrics.counter('wernicke_append_dead_letters_total', 'Appended rows the sheet rejected and that were moved to the dead-letter file.')
+
+def record_rows_scanned(count):
+    # Added up per request and observed when the response is sent
+    if has_request_context():
+        g.rows_scanned = g.get('rows_scanned', 0) + count
+
 # Replace with your Google Sheets API credentials file
 service_account_file = os.environ.get('GOOGLE_SHEETS_CREDENTIALS_FILE')
 
@@ -27,79 +69,228 @@ RANGE_NAME = 'シート1!A:G'
 USER_SHEET_ID = os.environ.get('USERSHEET_ID')
 USER_RANGE_NAME = 'シート1!A:C'
 
+# Column A of the word sheet holds when the word was added, in Japan time
+JST = timezone(timedelta(hours=9))
 
-def get_google_sheets_service():
+# 'sheets' (default) or 'sqlite' for a local database, e.g. for benchmarks
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'sheets')
+SQLITE_STORAGE_PATH = os.environ.get('SQLITE_STORAGE_PATH', 'wernicke.db')
+
+# Appended rows are held this long (or until this many are waiting) and written together; 0 disables
+APPEND_BUFFER_DELAY_MS = int(os.environ.get('APPEND_BUFFER_DELAY_MS', 300))
+APPEND_BUFFER_MAX_ROWS = int(os.environ.get('APPEND_BUFFER_MAX_ROWS', 50))
+APPEND_JOURNAL_PATH = os.environ.get('APPEND_JOURNAL_PATH', 'append_journal.jsonl')
+# Rows the sheet rejects for good (4xx) are moved here instead of being retried
+APPEND_DEAD_LETTER_PATH = os.environ.get('APPEND_DEAD_LETTER_PATH', 'append_dead_letter.jsonl')
+
+# Google Sheets quota for the service account; requests beyond it wait instead of failing
+SHEETS_READS_PER_MINUTE = int(os.environ.get('SHEETS_READS_PER_MINUTE', 60))
+SHEETS_WRITES_PER_MINUTE = int(os.environ.get('SHEETS_WRITES_PER_MINUTE', 60))
+SHEETS_MAX_RETRIES = int(os.environ.get('SHEETS_MAX_RETRIES', 5))
+# Seconds before a Sheets HTTP request gives up
+SHEETS_HTTP_TIMEOUT = int(os.environ.get('SHEETS_HTTP_TIMEOUT', 60))
+
+# Load the sheets into memory in the background as soon as the worker starts
+WARMUP_ON_START = os.environ.get('WARMUP_ON_START', '1') == '1'
+
+# Seconds before the in-process word store / user directory re-read the whole sheet
+WORD_STORE_TTL = int(os.environ.get('WORD_STORE_TTL', 300))
+USER_DIRECTORY_TTL = int(os.environ.get('USER_DIRECTORY_TTL', 300))
+
+# Maximum number of OpenAI calls made at the same time when filling missing content
+ENRICHMENT_WORKERS = int(os.environ.get('ENRICHMENT_WORKERS', 8))
+# Number of words sent to OpenAI in one batched request
+ENRICHMENT_BATCH_SIZE = int(os.environ.get('ENRICHMENT_BATCH_SIZE', 10))
+
+# On-disk cache of table_content results shared by every student
+ENRICHMENT_CACHE_PATH = os.environ.get('ENRICHMENT_CACHE_PATH', 'enrichment_cache.db')
+ENRICHMENT_CACHE_MAX_ENTRIES = int(os.environ.get('ENRICHMENT_CACHE_MAX_ENTRIES', 50000))
+
+# Background enrichment for add_word: worker threads and how many words may wait
+ENRICHMENT_QUEUE_WORKERS = int(os.environ.get('ENRICHMENT_QUEUE_WORKERS', 4))
+ENRICHMENT_QUEUE_SIZE = int(os.environ.get('ENRICHMENT_QUEUE_SIZE', 500))
+
+
+# Seconds spent in each cold start step, reported by /warmup
+startup_timings = {}
+
+@lru_cache(maxsize=None)
+def get_google_credentials():
+    # Parsed once and shared; google-auth refreshes the token for every thread that uses it
     creds_json = base64.b64decode(service_account_file)
-    creds = service_account.Credentials.from_service_account_info(json.loads(creds_json))
-    service = build('sheets', 'v4', credentials=creds)
+    return service_account.Credentials.from_service_account_info(json.loads(creds_json))
+
+def get_google_sheets_service():
+    # Called once per thread: httplib2 is not thread-safe, so every thread gets its own
+    # Http, which then keeps its connection to the API open between requests
+    start = time.perf_counter()
+    http = AuthorizedHttp(get_google_credentials(), http=httplib2.Http(timeout=SHEETS_HTTP_TIMEOUT))
+    # Use the discovery document bundled with google-api-python-client instead of fetching it
+    service = build('sheets', 'v4', http=http, static_discovery=True, cache_discovery=False)
+    startup_timings.setdefault('sheets_service_seconds', time.perf_counter() - start)
     return service
 
-# Initialize Google Sheets Service at the start
-service = get_google_sheets_service()
+# Pick the storage behind sheet_operation; the SQLite one needs no Google credentials
+sheets_scheduler = None
+if STORAGE_BACKEND == 'sqlite':
+    storage = SQLiteStorage(SQLITE_STORAGE_PATH, on_rows_read=record_rows_scanned)
+else:
+    sheets_scheduler = SheetsScheduler(
+        reads_per_minute=SHEETS_READS_PER_MINUTE,
+        writes_per_minute=SHEETS_WRITES_PER_MINUTE,
+        max_retries=SHEETS_MAX_RETRIES
+    )
+    storage = SheetsStorage(
+        get_google_sheets_service,  # Built on first use in each thread
+        on_rows_read=record_rows_scanned,
+        execute=sheets_scheduler.execute
+    )
+
+def background_priority():
+    # Sheets requests made by background work wait behind students' requests when quota is short
+    return sheets_scheduler.background() if sheets_scheduler else nullcontext()
+
+def flush_appended_rows(spreadsheet_id, range_name, rows):
+    with sheet_operation_seconds.time(operation="append_flush"):
+        storage.append(spreadsheet_id, range_name, rows)
+
+def forget_dead_letters(spreadsheet_id, range_name, rows):
+    # The indexes already hold the dropped rows, so their row numbers are off until reloaded
+    if spreadsheet_id == SPREADSHEET_ID:
+        word_store.invalidate()
+    elif spreadsheet_id == USER_SHEET_ID:
+        user_directory.invalidate()
+
+# Appends are buffered and journaled to disk, then written as one multi-row append
+append_buffer = AppendBuffer(
+    flush_appended_rows,
+    max_delay=APPEND_BUFFER_DELAY_MS / 1000,
+    max_rows=APPEND_BUFFER_MAX_ROWS,
+    journal_path=APPEND_JOURNAL_PATH,
+    is_permanent=is_permanent_error,
+    dead_letter_path=APPEND_DEAD_LETTER_PATH,
+    on_dead_letter=forget_dead_letters
+)
+atexit.register(append_buffer.flush, force=True)
 
 def sheet_operation(operation, spreadsheet_id, range_name, data=None, user_id=None, word=None):
-    sheet = service.spreadsheets()
+    with sheet_operation_seconds.time(operation=operation):
+        return _sheet_operation(operation, spreadsheet_id, range_name, data=data, user_id=user_id, word=word)
+
+def _sheet_operation(operation, spreadsheet_id, range_name, data=None, user_id=None, word=None):
+    if operation == "append":
+        append_buffer.add(spreadsheet_id, range_name, data)
+        return
+    # Any other operation must see the buffered rows, and row numbers must match the sheet.
+    # If they can't be written right now the operation still goes ahead: the rows stay queued
+    # with backoff, and writes by row number are verified against the sheet anyway
+    try:
+        append_buffer.flush(spreadsheet_id)
+    except Exception as e:
+        print("Buffered rows could not be written yet:", e)
     if operation == "get":
-        result = sheet.values().get(spreadsheetId=spreadsheet_id, range=range_name).execute()
-        return result.get('values', [])
-    elif operation == "append":
-        body = {'values': [data]}
-        sheet.values().append(
-            spreadsheetId=spreadsheet_id, 
-            range=range_name, 
-            valueInputOption='USER_ENTERED', 
-            body=body
-        ).execute()
+        return storage.get(spreadsheet_id, range_name)
     elif operation == "update":
-        body = {'values': [data]}
-        sheet.values().update(
-            spreadsheetId=spreadsheet_id, 
-            range=range_name, 
-            valueInputOption='USER_ENTERED', 
-            body=body
-        ).execute()
-    
+        storage.update(spreadsheet_id, range_name, [data])
+    elif operation == "batch_update":
+        # data is a list of (range_name, row_values) pairs written in one request
+        storage.batch_update(spreadsheet_id, data)
+    elif operation == "batch_get":
+        # data is a list of small ranges read in one request
+        return storage.batch_get(spreadsheet_id, data)
+    elif operation == "select":
+        # Rows matching data, e.g. {'B': user_id, 'C': words}, with only the columns of range_name
+        return storage.select(spreadsheet_id, range_name, data)
     elif operation == "delete":
-        values = sheet_operation("get", spreadsheet_id, range_name)
-        for index, row in enumerate(values):
-            if len(row) > 2 and row[1] == user_id and row[2] == word:
-                body = {
-                    "requests": [{
-                        "deleteDimension": {
-                            "range": {
-                                "sheetId": 0,  # Adjust if using a specific sheet within the spreadsheet
-                                "dimension": "ROWS",
-                                "startIndex": index,
-                                "endIndex": index + 1
-                            }
-                        }
-                    }]
-                }
-                response = sheet.batchUpdate(spreadsheetId=spreadsheet_id, body=body).execute()
-                return response  # Or a custom response indicating success
-        return None
+        # Removes every row matching (user_id, word), or every (user_id, word) pair listed in data;
+        # returns the deleted row numbers
+        pairs = data if data is not None else [(user_id, word)]
+        return storage.delete(spreadsheet_id, range_name, pairs)
+    elif operation == "delete_rows":
+        # data is a list of 1-based sheet row numbers
+        return storage.delete_rows(spreadsheet_id, range_name, data)
+
+def read_word_keys(row_numbers):
+    # Columns B:C (user_id, word) of the given rows, in one request
+    cells = sheet_operation("batch_get", SPREADSHEET_ID, None, data=[f'シート1!B{row_number}:C{row_number}' for row_number in row_numbers])
+    return [values[0] if values else [] for values in cells]
+
+def find_word_rows(user_id, words):
+    found = sheet_operation("select", SPREADSHEET_ID, 'シート1!C:C', data={'B': user_id, 'C': words})
+    return [(row_number, values[0]) for row_number, values in found]
+
+def read_with_pending(spreadsheet_id, range_name):
+    # Rows still queued in the append buffer (e.g. while appends fail) are part of the sheet for
+    # the indexes, else a reload would forget them; nothing is flushed between the read and the queue
+    with append_buffer.paused():
+        return sheet_operation("get", spreadsheet_id, range_name) + append_buffer.pending_rows(spreadsheet_id)
+
+def load_user_rows(first_row):
+    if first_row == 1:
+        return read_with_pending(USER_SHEET_ID, 'シート1!A1:D')
+    return sheet_operation("get", USER_SHEET_ID, f'シート1!A{first_row}:D')
+
+# Word sheet loaded once and indexed by user_id, kept in sync by the write routes; row numbers
+# it hands out are checked against the sheet before anything is written to them
+word_store = WordStore(
+    lambda: read_with_pending(SPREADSHEET_ID, RANGE_NAME),
+    ttl=WORD_STORE_TTL,
+    read_keys=read_word_keys,
+    find_rows=find_word_rows
+)
+
+def read_user_id(row_number):
+    values = sheet_operation("batch_get", USER_SHEET_ID, None, data=[f'シート1!C{row_number}'])[0]
+    return values[0][0] if values and values[0] else None
+
+def find_user_row(user_id):
+    found = sheet_operation("select", USER_SHEET_ID, 'シート1!C:C', data={'C': user_id})
+    return found[0][0] if found else None
+
+# User sheet indexed by email and user_id; new rows are picked up incrementally on a miss,
+# and row numbers are checked against the sheet before a nickname is written
+user_directory = UserDirectory(
+    load_user_rows,
+    ttl=USER_DIRECTORY_TTL,
+    read_user_id=read_user_id,
+    find_user_row=find_user_row,
+    has_pending=lambda: bool(append_buffer.pending_rows(USER_SHEET_ID))
+)
+
+# Identical requests in flight share one execution; write routes take a lock per key
+single_flight = SingleFlight()
+key_locks = KeyedLocks()
+# Queueing a row for the sheet and appending it to the in-process copy happen under one lock,
+# so concurrent appends get the same row order in both
+word_append_lock = threading.Lock()
+user_append_lock = threading.Lock()
+# Held from locating word sheet rows by number until they are written or deleted, so a
+# concurrent delete cannot shift them in between
+word_rows_lock = threading.Lock()
 
 
 def get_or_create_user_id(email):
-    values = sheet_operation("get", USER_SHEET_ID, USER_RANGE_NAME)
-    
-    # Search for email in the first column and get ID from the third column
-    for row in values:
-        if len(row) > 0 and row[0] == email:
-            return row[2]  # Assuming the user ID is in the third column
-
-    # If not found, create a new user ID, append it, and return it
-    new_user_id = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
-    new_row = [email, '', new_user_id]
-    sheet_operation("append", USER_SHEET_ID, USER_RANGE_NAME, data=new_row)
-    return new_user_id
+    # The lookup and the append happen under one lock per email, so one email never gets two IDs
+    with key_locks.lock(('email', email)):
+        # Search for email in the first column and get ID from the third column
+        _, row = user_directory.find_by_email(email)
+        if row is not None:
+            return row[2] if len(row) > 2 else ''  # Assuming the user ID is in the third column
+
+        # If not found, create a new user ID, append it, and return it
+        new_user_id = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
+        new_row = [email, '', new_user_id]
+        with user_append_lock:
+            sheet_operation("append", USER_SHEET_ID, USER_RANGE_NAME, data=new_row)
+            user_directory.append(new_row)
+        return new_user_id
 
 @app.route('/get_or_create_user', methods=['POST'])
 def get_or_create_user():
     data = request.json
     email = data.get('email')
     if email:
-        user_id = get_or_create_user_id(email)
+        user_id = single_flight.do(('get_or_create_user', email), get_or_create_user_id, email)
         return jsonify({'user_id': user_id})
     else:
         return jsonify({'error': 'Email is required'}), 400
@@ -121,31 +312,54 @@ def get_or_create_user():
 
 #     return {'words': matching_words}
     
+def parse_time_bound(value, end_of_day=False):
+    # Accepts 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS'; a bare 'until' date covers that whole day
+    if value is None or value == '':
+        return ''
+    if not isinstance(value, str):
+        raise ValueError(f"Not a date: {value!r}")
+    value = value.replace('T', ' ')
+    if len(value) == 10:
+        datetime.strptime(value, '%Y-%m-%d')
+        return value + (' 23:59:59' if end_of_day else ' 00:00:00')
+    return datetime.strptime(value, TIMESTAMP_FORMAT).strftime(TIMESTAMP_FORMAT)
+
+def get_word_details(user_id, since='', until=''):
+    # The stored records are turned into dicts only here, right before the response is serialized
+    user_rows = word_store.user_rows(user_id, since, until)
+    record_rows_scanned(len(user_rows))
+    return [record.to_dict() for _, record in user_rows]
+
 @app.route('/get_words', methods=['GET'])
 def get_words():
     user_id = request.args.get('user_id')
     if not user_id:
         return jsonify({'error': 'User ID is required'}), 400
+    try:
+        since = parse_time_bound(request.args.get('since'))
+        until = parse_time_bound(request.args.get('until'), end_of_day=True)
+    except ValueError:
+        return jsonify({'error': "since/until must look like 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS'"}), 400
 
     print("Received user_id in Flask:", user_id) 
-    values = sheet_operation("get", SPREADSHEET_ID, RANGE_NAME)
-
-    # List to hold the words and their details
-    word_details = []
-    for row in values:
-        if len(row) > 1 and row[1] == user_id:  # Ensure row has at least 2 elements and matches user_id
-            # Fill missing elements with empty strings
-            filled_row = row + [''] * (7 - len(row))  # Ensure row has at least 7 elements
-            word_info = {
-                "word": filled_row[2],
-                "pronunciation": filled_row[3],
-                "definition": filled_row[4],
-                "synonyms": filled_row[5],
-                "examples": filled_row[6]
-            }
-            word_details.append(word_info)
-
-    return word_details
+    # Streamlit reruns often ask for the same list at the same moment
+    words = single_flight.do(('get_words', user_id, since, until), get_word_details, user_id, since, until)
+    return json_response(words)  # 304 when the client already has this list
+
+# Words of many students in one response, e.g. a whole class for the Admin Panel
+@app.route('/get_words_bulk', methods=['POST'])
+def get_words_bulk():
+    data = request.json or {}
+    user_ids = data.get('user_ids')
+    if not isinstance(user_ids, list):
+        return jsonify({'error': 'A list of user IDs is required'}), 400
+    try:
+        since = parse_time_bound(data.get('since'))
+        until = parse_time_bound(data.get('until'), end_of_day=True)
+    except ValueError:
+        return jsonify({'error': "since/until must look like 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS'"}), 400
+
+    return json_response({user_id: get_word_details(user_id, since, until) for user_id in dict.fromkeys(user_ids)})
 
 # def add_word_to_sheet(sheet, user_id, word):
 #     # Fetch data from GPT-3
@@ -205,94 +419,259 @@ def get_words():
 #     return False
     
 
+enrichment_cache = EnrichmentCache(ENRICHMENT_CACHE_PATH, max_entries=ENRICHMENT_CACHE_MAX_ENTRIES)
+enrichment_jobs = JobQueue(workers=ENRICHMENT_QUEUE_WORKERS, max_queued=ENRICHMENT_QUEUE_SIZE)
+
 def format_list_with_newlines(items):
     return '\n'.join(f'{index+1}. {item}' for index, item in enumerate(items))
 
-def table_content(word):
-    example_json = {
-        "pronunciation": "",
-        "definition": "",
-        "synonyms": ["", "", ""],
-        "examples": ["", "", ""]
+example_json = {
+    "pronunciation": "",
+    "definition": "",
+    "synonyms": ["", "", ""],
+    "examples": ["", "", ""]
+}
+
+def validate_word_content(word_data):
+    # Returns the sheet-ready content, or None if word_data does not follow example_json
+    if not isinstance(word_data, dict):
+        return None
+    if not all(isinstance(word_data.get(key), str) for key in ("pronunciation", "definition")):
+        return None
+    if not all(isinstance(word_data.get(key), list) for key in ("synonyms", "examples")):
+        return None
+    return {
+        "pronunciation": word_data["pronunciation"],
+        "definition": word_data["definition"],
+        "synonyms": format_list_with_newlines(word_data["synonyms"]),
+        "examples": format_list_with_newlines(word_data["examples"])
     }
+
+def table_content(word):
+    # Common words are added by many students, so only ask OpenAI the first time
+    cached = enrichment_cache.get(word)
+    if cached is not None:
+        return dict(cached, word=word)
+    return request_table_content(word)
+
+def request_table_content(word):
+    # Asks OpenAI without looking at the cache, and stores the answer
     prompt = f"Provide the phonetic symbol, shorter than 20 words definition, 3 synonyms, and 3 example sentences for the word '{word}' in JSON format."
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo-1106",
-        response_format={ "type": "json_object" },
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant designed to output JSON like the following data schema" + json.dumps(example_json)},
-            {"role": "user", "content": prompt}
-        ]
-    )
+    with openai_seconds.time(kind="single"):
+        response = client.chat.completions.create(
+            model="gpt-3.5-turbo-1106",
+            response_format={ "type": "json_object" },
+            messages=[
+                {"role": "system", "content": "You are a helpful assistant designed to output JSON like the following data schema" + json.dumps(example_json)},
+                {"role": "user", "content": prompt}
+            ]
+        )
     content = response.choices[0].message.content
     word_data = json.loads(content)
     
-    return {
-        "word": word,
+    content = {
         "pronunciation": word_data.get("pronunciation", ""),
         "definition": word_data.get("definition", ""),
         "synonyms": format_list_with_newlines(word_data.get("synonyms", [])),
         "examples": format_list_with_newlines(word_data.get("examples", []))
     }
+    enrichment_cache.set(word, content)
+    return dict(content, word=word)
+
+def table_content_batch(words):
+    # Returns {word: word_data}; words that could not be filled are left out
+    results = {}
+    pending = {}  # normalized word -> words as the students typed them
+    for word in words:
+        cached = enrichment_cache.get(word)
+        if cached is not None:
+            results[word] = dict(cached, word=word)
+        else:
+            pending.setdefault(normalize_word(word), []).append(word)
+
+    # One request for all the words, so the system prompt is only sent once
+    if len(pending) > 1:
+        batch_json = {"words": [dict(example_json, word="")]}
+        prompt = ("For each of the following words, provide the phonetic symbol, shorter than 20 words definition, "
+                  "3 synonyms, and 3 example sentences in JSON format: " + json.dumps(list(pending)))
+        try:
+            with openai_seconds.time(kind="batch"):
+                response = client.chat.completions.create(
+                    model="gpt-3.5-turbo-1106",
+                    response_format={ "type": "json_object" },
+                    messages=[
+                        {"role": "system", "content": "You are a helpful assistant designed to output JSON like the following data schema" + json.dumps(batch_json)},
+                        {"role": "user", "content": prompt}
+                    ]
+                )
+            items = json.loads(response.choices[0].message.content).get("words", [])
+        except Exception as e:
+            print("Batched table_content failed:", e)
+            items = []
+
+        for item in items if isinstance(items, list) else []:
+            content = validate_word_content(item)
+            key = normalize_word(item.get("word", "")) if content is not None and isinstance(item.get("word"), str) else None
+            if key in pending:
+                for word in pending.pop(key):
+                    enrichment_cache.set(word, content)
+                    results[word] = dict(content, word=word)
+
+    # Anything the batch missed falls back to one request per word; the cache was already checked above
+    for same_words in pending.values():
+        try:
+            content = request_table_content(same_words[0])
+        except Exception as e:
+            print(f"Failed to fill content for '{same_words[0]}':", e)
+            continue
+        for word in same_words:
+            results[word] = dict(content, word=word)
+    return results
+
+def enrich_word(user_id, word):
+    # Background job queued by add_word: fill in the bare row once OpenAI answers
+    word_data = request_table_content(word)
+    update_values = [
+        word_data["pronunciation"],
+        word_data["definition"],
+        word_data["synonyms"],
+        word_data["examples"]
+    ]
+    for row_number, record in word_store.user_rows(user_id):
+        if record.word == word and record.missing_content():
+            with background_priority(), word_rows_lock:
+                for row_number, _ in word_store.verified_rows(user_id, [(row_number, word)])[:1]:
+                    sheet_operation("update", SPREADSHEET_ID, f'シート1!D{row_number}:G{row_number}', data=update_values)
+                    word_store.update(row_number, 3, update_values)
+            return
 
 @app.route('/add_word', methods=['POST'])
 def add_word():
     data = request.json
     user_id, word = data['user_id'], data['word']
-    word_data = table_content(word)  # Continue using your function to get word details
+    # A double-clicked "Add Word" waits for the first request and then finds the word already there
+    with key_locks.lock(('add_word', user_id, word)):
+        if any(record.word == word for _, record in word_store.user_rows(user_id)):
+            return jsonify({'result': 'success', 'job_id': None, 'duplicate': True})
+        return jsonify(add_word_for_user(user_id, word))
+
+def add_word_for_user(user_id, word):
+    # Words already in the cache are written complete, the others are filled in the background
+    word_data = enrichment_cache.get(word)
 
     values = [
-        '',  # This will correspond to column A, which will be left empty
+        datetime.now(JST).strftime(TIMESTAMP_FORMAT),  # Column A: when the word was added
         user_id,  # This will be placed in column B
-        word,
-        word_data["pronunciation"],
-        word_data["definition"],
-        word_data["synonyms"],
-        word_data["examples"]
+        word
     ]
+    if word_data is not None:
+        values += [
+            word_data["pronunciation"],
+            word_data["definition"],
+            word_data["synonyms"],
+            word_data["examples"]
+        ]
 
-    sheet_operation("append", SPREADSHEET_ID, RANGE_NAME, data=values)
-    return jsonify({'result': 'success'})
+    with word_append_lock:
+        sheet_operation("append", SPREADSHEET_ID, RANGE_NAME, data=values)
+        word_store.append(values)
+
+    job_id = None
+    if word_data is None:
+        job_id = enrichment_jobs.submit(enrich_word, user_id, word, word=word)
+        if job_id is None:
+            # Queue is full: the word stays bare until "Fill Missing Content" is used
+            print(f"Enrichment queue full, '{word}' was added without content")
+    return {'result': 'success', 'job_id': job_id}
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = enrichment_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
 
 
 @app.route('/delete_word', methods=['POST'])
 def delete_word():
     data = request.json
     user_id, word = data['user_id'], data['word']
-    response = sheet_operation("delete", SPREADSHEET_ID, RANGE_NAME, user_id=user_id, word=word)
-    if response:
+    # Duplicates of the word are removed too
+    with word_rows_lock:
+        deleted = sheet_operation("delete", SPREADSHEET_ID, RANGE_NAME, user_id=user_id, word=word)
+        if deleted and word_store.delete_words(user_id, [word]) != deleted:
+            word_store.invalidate()  # The store's row positions no longer match the sheet
+    if deleted:
         return jsonify({'result': 'success'})
     else:
         return jsonify({'result': 'word not found'}), 404
 
 
+@app.route('/delete_words', methods=['POST'])
+def delete_words():
+    data = request.json or {}
+    user_id, words = data.get('user_id'), data.get('words')
+    if not user_id or not isinstance(words, list):
+        return jsonify({'error': 'A user ID and a list of words are required'}), 400
+    # Every row for these words is found from one read and removed in one batchUpdate
+    with word_rows_lock:
+        deleted = sheet_operation("delete", SPREADSHEET_ID, RANGE_NAME, data=[(user_id, word) for word in words])
+        if deleted and word_store.delete_words(user_id, words) != deleted:
+            word_store.invalidate()
+    if deleted:
+        return jsonify({'result': 'success', 'deleted': len(deleted)})
+    else:
+        return jsonify({'result': 'words not found'}), 404
+
+
 def fill_missing_content(user_id):
-    # Fetch rows from the Google Sheet for the specified user_id
-    values = sheet_operation("get", SPREADSHEET_ID, RANGE_NAME)
-    updated_count = 0
-    
-    for i, row in enumerate(values):
-        # Assuming the user_id is in a specific column, e.g., the third column
-        if row[1] == user_id and (len(row) < 4 or not all(row[3:6])):
-            word = row[2]  # Assuming the word is in the first column
-            word_data = table_content(word)
-            update_values = [
+    # Rows of the specified user_id that are missing content, with their sheet row numbers
+    user_rows = word_store.user_rows(user_id)
+    record_rows_scanned(len(user_rows))
+    missing = [
+        (row_number, record.word)
+        for row_number, record in user_rows
+        if record.missing_content()
+    ]
+    if not missing:
+        return {'result': 'no updates needed'}
+
+    # Ask OpenAI for several batches of words at once, then write every filled row in one request
+    words = list(dict.fromkeys(word for _, word in missing))
+    batches = [words[i:i + ENRICHMENT_BATCH_SIZE] for i in range(0, len(words), ENRICHMENT_BATCH_SIZE)]
+    filled = {}
+    with ThreadPoolExecutor(max_workers=ENRICHMENT_WORKERS) as executor:
+        futures = [executor.submit(table_content_batch, batch) for batch in batches]
+        for future in as_completed(futures):
+            filled.update(future.result())
+            print(f"Filling missing content for {user_id}: {len(filled)}/{len(words)}")
+
+    failed = [word for word in words if word not in filled]
+
+    updates = []
+    with word_rows_lock:
+        for row_number, word in word_store.verified_rows(user_id, [(row_number, word) for row_number, word in missing if word in filled]):
+            word_data = filled[word]
+            updates.append((row_number, [
                 word_data["pronunciation"],
                 word_data["definition"],
                 word_data["synonyms"],
                 word_data["examples"]
-            ]
+            ]))
+        if updates:
+            sheet_operation("batch_update", SPREADSHEET_ID, None,
+                            data=[(f'シート1!D{row_number}:G{row_number}', values) for row_number, values in updates])
+            for row_number, values in updates:
+                word_store.update(row_number, 3, values)
 
-            # Update the row individually
-            update_range = f'シート1!D{i+1}:G{i+1}'
-            sheet_operation("update", SPREADSHEET_ID, update_range, data=update_values)
-            updated_count += 1
+    # Return how many words were updated and which ones could not be filled
+    return {'result': 'success' if updates else 'failed', 'updated': len(updates), 'failed': failed}
 
-    # Return the result indicating how many words were updated
-    if updated_count > 0:
-        return {'result': 'success', 'updated': updated_count}
-    else:
-        return {'result': 'no updates needed'}
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(enrichment_cache.stats())
 
 
 # Endpoint to trigger filling missing content for a user
@@ -300,19 +679,19 @@ def fill_missing_content(user_id):
 def fill_missing_content_endpoint():
     data = request.json
     user_id = data['user_id']
-    response = fill_missing_content(user_id)
+    # A second click while the first fill is running shares its result instead of calling OpenAI again
+    response = single_flight.do(('fill_missing_content', user_id), fill_missing_content, user_id)
     return response
 
 @app.route('/check_nickname', methods=['POST'])
 def check_nickname():
     data = request.json
     user_id = data['user_id']
-    values = sheet_operation("get", USER_SHEET_ID, 'シート1!A:D')
 
-    for row in values:
-        if len(row) > 2 and row[2] == user_id:
-            nickname = row[3] if len(row) > 3 else None
-            return {'nickname': nickname}
+    _, row = user_directory.find_by_user_id(user_id)
+    if row is not None:
+        nickname = row[3] if len(row) > 3 else None
+        return {'nickname': nickname}
 
     return {'error': 'User not found'}, 404
 
@@ -321,14 +700,15 @@ def update_nickname():
     data = request.json
     user_id = data['user_id']
     nickname = data['nickname']
-    
-    values = sheet_operation("get", USER_SHEET_ID, 'シート1!A:D')
 
-    for i, row in enumerate(values):
-        if row[2] == user_id:
-            range_to_update = f'シート1!D{i+1}'  # Constructing the range for the fourth column
-            sheet_operation("update", USER_SHEET_ID, range_to_update, data=[nickname])
-            return {'success': True}
+    row_number, _ = user_directory.find_by_user_id(user_id)
+    if row_number is not None:
+        row_number = user_directory.verified_row(row_number, user_id)
+    if row_number is not None:
+        range_to_update = f'シート1!D{row_number}'  # Constructing the range for the fourth column
+        sheet_operation("update", USER_SHEET_ID, range_to_update, data=[nickname])
+        user_directory.set_nickname(row_number, nickname)
+        return {'success': True}
 
     return {'error': 'User not found'}, 404
 
@@ -336,15 +716,84 @@ def update_nickname():
 def get_nicknames_and_ids():
     emails = request.json['emails']
 
-    values = sheet_operation("get", USER_SHEET_ID, 'シート1!A:D')
-
     nicknames_with_ids = {}
-    for row in values:
-        if len(row) >= 4 and row[0] in emails:  # Column A contains emails
+    for _, row in user_directory.rows_for_emails(emails):  # Column A contains emails
+        if len(row) >= 4:
             nicknames_with_ids[row[3]] = row[2]  # Column D contains nicknames, Column C contains user_id
 
     return nicknames_with_ids
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    if 'request_started' in g:
+        request_seconds.observe(time.perf_counter() - g.request_started, route=route, method=request.method)
+    requests_total.inc(route=route, method=request.method, status=response.status_code)
+    if response.status_code >= 500:
+        errors_total.inc(route=route, method=request.method)
+    rows_scanned.observe(g.get('rows_scanned', 0), route=route)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    # Values owned by other components are read when Prometheus scrapes
+    stats = enrichment_cache.stats()
+    cache_lookups.set(stats['hits'], result="hit")
+    cache_lookups.set(stats['misses'], result="miss")
+    queue_depth.set(enrichment_jobs.depth(), queue="enrichment")
+    queue_depth.set(append_buffer.pending_count(), queue="append_buffer")
+    single_flight_shared.set(single_flight.shared)
+    append_dead_letters.set(append_buffer.dead_lettered)
+    if sheets_scheduler:
+        queue_depth.set(sheets_scheduler.depth('read'), queue="sheets_read")
+        queue_depth.set(sheets_scheduler.depth('write'), queue="sheets_write")
+        sheets_retries.set(sheets_scheduler.retries)
+        sheets_throttled.set(sheets_scheduler.throttled)
+        sheets_clients.set(storage.services_created)
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+warmed_up = threading.Event()
+warm_up_lock = threading.Lock()  # A /warmup call during the startup warm-up waits for it
+
+def warm_up():
+    # Load the sheets before the first student needs them. Sheets clients are per thread, so
+    # building one here would not help request threads; only the shared credentials are parsed
+    with warm_up_lock:
+        if warmed_up.is_set():
+            return
+        start = time.perf_counter()
+        try:
+            if isinstance(storage, SheetsStorage):
+                get_google_credentials()
+            with background_priority():
+                word_store.reload()
+                user_directory.reload()
+            warmed_up.set()
+        except Exception as e:
+            print("Warm-up failed:", e)
+        startup_timings['warmup_seconds'] = time.perf_counter() - start
+        print("Startup timings:", startup_timings)
+
+# Render's health check can call this so a woken instance is ready before real traffic
+@app.route('/warmup', methods=['GET'])
+def warmup():
+    # Returns once the sheets are loaded, by this call or by the one still running since startup
+    warm_up()
+    return jsonify(startup_timings)
+
+@app.after_request
+def record_first_request(response):
+    startup_timings.setdefault('first_request_seconds', time.perf_counter() - STARTED_AT)
+    return response
+
+startup_timings['import_seconds'] = time.perf_counter() - STARTED_AT
+if WARMUP_ON_START:
+    threading.Thread(target=warm_up, daemon=True).start()
+
 # @app.route('/add_word_for_users', methods=['POST'])
 # def add_word_for_users():
 #     data = request.json
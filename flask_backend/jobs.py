@@ -0,0 +1,64 @@
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+
+
+class JobQueue:
+    """Bounded in-process queue worked off by a fixed number of background threads."""
+
+    def __init__(self, workers=4, max_queued=500, max_jobs_kept=5000):
+        self._workers = workers
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._max_jobs_kept = max_jobs_kept
+        self._jobs = OrderedDict()  # job_id -> status dict, oldest first
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _start(self):
+        # Threads are started on first use so they are created after gunicorn forks
+        if not self._threads:
+            for _ in range(self._workers):
+                thread = threading.Thread(target=self._work, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job, fn, args = self._queue.get()
+            job['status'] = 'running'
+            try:
+                fn(*args)
+                job['status'] = 'done'
+            except Exception as e:
+                print(f"Job {job['id']} failed:", e)
+                job['status'] = 'failed'
+                job['error'] = str(e)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, fn, *args, **info):
+        """Queues fn(*args) and returns its job_id, or None when the queue is full."""
+        job = dict(info, id=uuid.uuid4().hex, status='queued', error=None)
+        with self._lock:
+            self._start()
+            try:
+                self._queue.put_nowait((job, fn, args))
+            except queue.Full:
+                return None
+            self._jobs[job['id']] = job
+            # Forget the oldest finished jobs so the status table stays bounded
+            for job_id in list(self._jobs):
+                if len(self._jobs) <= self._max_jobs_kept:
+                    break
+                if self._jobs[job_id]['status'] in ('done', 'failed'):
+                    del self._jobs[job_id]
+        return job['id']
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def depth(self):
+        return self._queue.qsize()
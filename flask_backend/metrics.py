@@ -0,0 +1,116 @@
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+class _Metric:
+    def __init__(self, registry, name, help_text, kind):
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self._lock = threading.Lock()
+        self._values = {}  # sorted label tuple -> value
+        registry.append(self)
+
+    def lines(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} {self.kind}'
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(labels)} {value}'
+
+
+class Counter(_Metric):
+    def __init__(self, registry, name, help_text):
+        super().__init__(registry, name, help_text, 'counter')
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        # For totals kept by another component and copied in when scraped; they only ever grow
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+
+class Gauge(_Metric):
+    def __init__(self, registry, name, help_text):
+        super().__init__(registry, name, help_text, 'gauge')
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(_Metric):
+    def __init__(self, registry, name, help_text, buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help_text, 'histogram')
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One slot per bucket, then +Inf, then the running sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def lines(self):
+        yield f'# HELP {self.name} {self.help_text}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        for labels, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield f'{self.name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(labels)} {counts[-1]}'
+            yield f'{self.name}_count{_format_labels(labels)} {cumulative}'
+
+
+class Registry(list):
+    """All metrics of the process, rendered in the Prometheus text format."""
+
+    def counter(self, name, help_text):
+        return Counter(self, name, help_text)
+
+    def gauge(self, name, help_text):
+        return Gauge(self, name, help_text)
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return Histogram(self, name, help_text, buckets)
+
+    def render(self):
+        return '\n'.join(line for metric in self for line in metric.lines()) + '\n'
@@ -0,0 +1,47 @@
+import gzip
+import hashlib
+import json
+
+from flask import Response, request
+
+# Both are optional: without them responses fall back to the json module and gzip
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_BYTES = 1024  # Smaller bodies are sent as they are
+
+
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(payload):
+    """JSON response with an ETag; answers 304 to a matching If-None-Match and compresses per Accept-Encoding."""
+    body = dumps(payload)
+    # Weak, since the same list is sent with different Content-Encodings
+    etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    response.vary.add('Accept-Encoding')
+    if len(body) >= MIN_COMPRESS_BYTES:
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            response.set_data(brotli.compress(body, quality=5))
+            response.content_encoding = 'br'
+        elif accepted['gzip']:
+            response.set_data(gzip.compress(body, compresslevel=5))
+            response.content_encoding = 'gzip'
+    return response
@@ -0,0 +1,102 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from googleapiclient.errors import HttpError
+
+INTERACTIVE = 0
+BACKGROUND = 1
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def is_permanent_error(error):
+    # A 4xx other than 429 (e.g. a malformed row or a missing sheet) fails the same way every time
+    return isinstance(error, HttpError) and 400 <= error.resp.status < 500 and error.resp.status not in RETRY_STATUSES
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self._rate = per_minute / 60
+        self._updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def seconds_until_token(self):
+        return max(0.0, (1 - self.tokens) / self._rate)
+
+
+class SheetsScheduler:
+    """Runs Sheets API requests within per-minute quotas, retrying 429s and 5xx with backoff."""
+
+    def __init__(self, reads_per_minute=60, writes_per_minute=60, max_retries=5, base_delay=1.0, max_delay=32.0):
+        self._buckets = {'read': TokenBucket(reads_per_minute), 'write': TokenBucket(writes_per_minute)}
+        self._waiting = {'read': [], 'write': []}  # heaps of (priority, arrival) tickets
+        self._cond = threading.Condition()
+        self._arrivals = itertools.count()
+        self._local = threading.local()
+        self._max_retries = max_retries
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self.retries = 0
+        self.throttled = 0
+
+    @contextmanager
+    def background(self):
+        # Requests made inside this block wait behind interactive ones when quota is short
+        previous = getattr(self._local, 'priority', INTERACTIVE)
+        self._local.priority = BACKGROUND
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def _acquire(self, kind):
+        bucket = self._buckets[kind]
+        waiting = self._waiting[kind]
+        ticket = (getattr(self._local, 'priority', INTERACTIVE), next(self._arrivals))
+        with self._cond:
+            heapq.heappush(waiting, ticket)
+            try:
+                bucket.refill()
+                if waiting[0] != ticket or bucket.tokens < 1:
+                    self.throttled += 1
+                while True:
+                    bucket.refill()
+                    if waiting[0] == ticket and bucket.tokens >= 1:
+                        bucket.tokens -= 1
+                        return
+                    self._cond.wait(timeout=max(bucket.seconds_until_token(), 0.01))
+            finally:
+                waiting.remove(ticket)
+                heapq.heapify(waiting)
+                self._cond.notify_all()
+
+    def execute(self, request, kind='read', idempotent=True):
+        """Calls request.execute(); appends pass idempotent=False so only 429s are retried."""
+        for attempt in range(self._max_retries + 1):
+            self._acquire(kind)
+            try:
+                return request.execute()
+            except HttpError as e:
+                status = e.resp.status
+                retry = status == 429 or (idempotent and status in RETRY_STATUSES)
+                if not retry or attempt == self._max_retries:
+                    raise
+            except (ConnectionError, TimeoutError):
+                if not idempotent or attempt == self._max_retries:
+                    raise
+            # Full jitter keeps a classroom of retries from hitting the API in lockstep
+            self.retries += 1
+            time.sleep(random.uniform(0, min(self._max_delay, self._base_delay * 2 ** attempt)))
+
+    def depth(self, kind):
+        with self._cond:
+            return len(self._waiting[kind])
@@ -0,0 +1,305 @@
+import re
+import sqlite3
+import threading
+
+COLUMNS = 'ABCDEFGH'  # The word and user sheets only use columns A to G
+BATCH_GET_RANGES = 100  # Ranges per values.batchGet, keeps the request URL short
+
+
+def parse_range(range_name):
+    # 'シート1!D5:G5' -> ('シート1', 3, 5, 6, 5); open ends like 'A:G' give None rows
+    sheet, _, cells = range_name.rpartition('!')
+    match = re.fullmatch(r'([A-Z])(\d*)(?::([A-Z])(\d*))?', cells)
+    if not match:
+        raise ValueError(f'Unsupported range: {range_name}')
+    first_col, first_row, last_col, last_row = match.groups()
+    if last_col is None:
+        last_col, last_row = first_col, first_row
+    return (
+        sheet,
+        COLUMNS.index(first_col),
+        int(first_row) if first_row else 1,
+        COLUMNS.index(last_col),
+        int(last_row) if last_row else None
+    )
+
+
+def _accepted_values(value):
+    # A filter value is either one value or a collection of accepted values
+    return set(value) if isinstance(value, (set, frozenset, list, tuple)) else {value}
+
+
+class SheetsStorage:
+    """Google Sheets API backend, the same calls sheet_operation always made."""
+
+    def __init__(self, create_service, on_rows_read=None, execute=None):
+        self._create_service = create_service
+        # execute(request, kind, idempotent) runs a request; the scheduler adds quotas and retries
+        self._execute = execute or (lambda request, kind='read', idempotent=True: request.execute())
+        self._on_rows_read = on_rows_read  # Called with the number of rows each read returned
+        self._local = threading.local()
+        self._services_lock = threading.Lock()
+        self.services_created = 0
+
+    @property
+    def service(self):
+        # googleapiclient/httplib2 objects must not be shared between threads, so each
+        # thread (gunicorn --threads, background workers) builds its own on first use and keeps it
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = self._local.service = self._create_service()
+            with self._services_lock:
+                self.services_created += 1
+        return service
+
+    def get(self, spreadsheet_id, range_name):
+        sheet = self.service.spreadsheets()
+        result = self._execute(sheet.values().get(spreadsheetId=spreadsheet_id, range=range_name), 'read')
+        values = result.get('values', [])
+        if self._on_rows_read:
+            self._on_rows_read(len(values))
+        return values
+
+    def batch_get(self, spreadsheet_id, ranges):
+        # Several small ranges read in one request; returns the values of each range in order
+        sheet = self.service.spreadsheets()
+        values = []
+        for start in range(0, len(ranges), BATCH_GET_RANGES):
+            request = sheet.values().batchGet(spreadsheetId=spreadsheet_id, ranges=ranges[start:start + BATCH_GET_RANGES])
+            result = self._execute(request, 'read')
+            values += [value_range.get('values', []) for value_range in result.get('valueRanges', [])]
+        if self._on_rows_read:
+            self._on_rows_read(sum(len(rows) for rows in values))
+        return values
+
+    def select(self, spreadsheet_id, range_name, where):
+        """Returns [(row_number, values), ...] for the rows matching where, e.g. {'B': user_id, 'C': {'apple', 'pear'}}.
+
+        Only the filter columns are read to find the rows; the columns of range_name are read
+        for the matching rows alone, unless the filter read already covered them.
+        """
+        sheet, first_col, _, last_col, _ = parse_range(range_name)
+        filters = {COLUMNS.index(col): _accepted_values(value) for col, value in where.items()}
+        key_first, key_last = min(filters), max(filters)
+        keys = self.get(spreadsheet_id, f'{sheet}!{COLUMNS[key_first]}:{COLUMNS[key_last]}')
+        found = [
+            (index + 1, row + [''] * (key_last - key_first + 1 - len(row)))
+            for index, row in enumerate(keys)
+            if all((row[col - key_first] if col - key_first < len(row) else '') in accepted for col, accepted in filters.items())
+        ]
+        if key_first <= first_col and last_col <= key_last:
+            return [(row_number, row[first_col - key_first:last_col - key_first + 1]) for row_number, row in found]
+        if not found:
+            return []
+        ranges = [f'{sheet}!{COLUMNS[first_col]}{row_number}:{COLUMNS[last_col]}{row_number}' for row_number, _ in found]
+        values = self.batch_get(spreadsheet_id, ranges)
+        return [(row_number, rows[0] if rows else []) for (row_number, _), rows in zip(found, values)]
+
+    def append(self, spreadsheet_id, range_name, rows):
+        sheet = self.service.spreadsheets()
+        body = {'values': rows}
+        request = sheet.values().append(
+            spreadsheetId=spreadsheet_id,
+            range=range_name,
+            valueInputOption='USER_ENTERED',
+            body=body
+        )
+        self._execute(request, 'write', idempotent=False)  # A retried append could add the rows twice
+
+    def update(self, spreadsheet_id, range_name, rows):
+        sheet = self.service.spreadsheets()
+        body = {'values': rows}
+        request = sheet.values().update(
+            spreadsheetId=spreadsheet_id,
+            range=range_name,
+            valueInputOption='USER_ENTERED',
+            body=body
+        )
+        self._execute(request, 'write')
+
+    def batch_update(self, spreadsheet_id, data):
+        # data is a list of (range_name, row_values) pairs written in one request
+        sheet = self.service.spreadsheets()
+        body = {
+            'valueInputOption': 'USER_ENTERED',
+            'data': [{'range': update_range, 'values': [values]} for update_range, values in data]
+        }
+        self._execute(sheet.values().batchUpdate(spreadsheetId=spreadsheet_id, body=body), 'write')
+
+    def delete_rows(self, spreadsheet_id, range_name, row_numbers):
+        # Removes the given 1-based rows with one batchUpdate, bottom-up so indexes stay valid
+        row_numbers = sorted(set(row_numbers), reverse=True)
+        if not row_numbers:
+            return 0
+        requests = []
+        for row_number in row_numbers:
+            if requests and requests[-1]["deleteDimension"]["range"]["startIndex"] == row_number:
+                requests[-1]["deleteDimension"]["range"]["startIndex"] = row_number - 1  # Grow the run of rows
+                continue
+            requests.append({
+                "deleteDimension": {
+                    "range": {
+                        "sheetId": 0,  # Adjust if using a specific sheet within the spreadsheet
+                        "dimension": "ROWS",
+                        "startIndex": row_number - 1,
+                        "endIndex": row_number
+                    }
+                }
+            })
+        sheet = self.service.spreadsheets()
+        # Not retried on 5xx: if the first attempt went through, rows below would be deleted
+        self._execute(sheet.batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": requests}), 'write', idempotent=False)
+        return len(row_numbers)
+
+    def delete(self, spreadsheet_id, range_name, pairs):
+        # Deletes every row whose columns B and C match one of the (user_id, word) pairs;
+        # only B:C is read to find them. Returns the deleted row numbers.
+        pairs = set(pairs)
+        sheet = parse_range(range_name)[0]
+        found = self.select(spreadsheet_id, f'{sheet}!B:C', {'B': {user_id for user_id, _ in pairs}, 'C': {word for _, word in pairs}})
+        row_numbers = [row_number for row_number, values in found if tuple(values) in pairs]
+        self.delete_rows(spreadsheet_id, range_name, row_numbers)
+        return row_numbers
+
+
+class SQLiteStorage:
+    """Local SQLite backend that stores sheet rows with real indexes on the lookup columns."""
+
+    def __init__(self, path, on_rows_read=None):
+        self._on_rows_read = on_rows_read  # Called with the number of rows each read returned
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        column_defs = ', '.join(f'{col.lower()} TEXT' for col in COLUMNS)
+        self._conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS sheet_rows (
+                spreadsheet_id TEXT, sheet TEXT, row_number INTEGER, {column_defs}
+            );
+            CREATE INDEX IF NOT EXISTS sheet_rows_position ON sheet_rows (spreadsheet_id, sheet, row_number);
+            CREATE INDEX IF NOT EXISTS sheet_rows_user_word ON sheet_rows (spreadsheet_id, b, c);
+            CREATE INDEX IF NOT EXISTS sheet_rows_email ON sheet_rows (spreadsheet_id, a);
+            CREATE INDEX IF NOT EXISTS sheet_rows_user_id ON sheet_rows (spreadsheet_id, c);
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def _trim(values):
+        # Like the Sheets API, drop trailing empty cells
+        values = ['' if value is None else value for value in values]
+        while values and values[-1] == '':
+            values.pop()
+        return values
+
+    def get(self, spreadsheet_id, range_name):
+        sheet, first_col, first_row, last_col, last_row = parse_range(range_name)
+        columns = ', '.join(col.lower() for col in COLUMNS[first_col:last_col + 1])
+        with self._lock:
+            found = self._conn.execute(
+                f"SELECT row_number, {columns} FROM sheet_rows "
+                "WHERE spreadsheet_id = ? AND sheet = ? AND row_number >= ? AND row_number <= ? "
+                "ORDER BY row_number",
+                (spreadsheet_id, sheet, first_row, last_row if last_row is not None else 2 ** 62)
+            ).fetchall()
+        rows = {row[0]: self._trim(row[1:]) for row in found}
+        values = [rows.get(number, []) for number in range(first_row, max(rows, default=first_row - 1) + 1)]
+        while values and not values[-1]:
+            values.pop()
+        if self._on_rows_read:
+            self._on_rows_read(len(values))
+        return values
+
+    def batch_get(self, spreadsheet_id, ranges):
+        return [self.get(spreadsheet_id, range_name) for range_name in ranges]
+
+    def select(self, spreadsheet_id, range_name, where):
+        # Same result as SheetsStorage.select, filtered by SQLite through the column indexes
+        sheet, first_col, _, last_col, _ = parse_range(range_name)
+        columns = ', '.join(col.lower() for col in COLUMNS[first_col:last_col + 1])
+        conditions, params = [], []
+        for col, value in where.items():
+            accepted = list(_accepted_values(value))
+            conditions.append(f"COALESCE({col.lower()}, '') IN ({', '.join('?' * len(accepted))})")
+            params += accepted
+        with self._lock:
+            found = self._conn.execute(
+                f"SELECT row_number, {columns} FROM sheet_rows "
+                f"WHERE spreadsheet_id = ? AND sheet = ? AND {' AND '.join(conditions)} ORDER BY row_number",
+                (spreadsheet_id, sheet, *params)
+            ).fetchall()
+        if self._on_rows_read:
+            self._on_rows_read(len(found))
+        return [(row[0], self._trim(row[1:])) for row in found]
+
+    def _set_cells(self, spreadsheet_id, sheet, row_number, first_col, values):
+        columns = [col.lower() for col in COLUMNS[first_col:first_col + len(values)]]
+        exists = self._conn.execute(
+            "SELECT 1 FROM sheet_rows WHERE spreadsheet_id = ? AND sheet = ? AND row_number = ?",
+            (spreadsheet_id, sheet, row_number)
+        ).fetchone()
+        if exists:
+            assignments = ', '.join(f'{col} = ?' for col in columns)
+            self._conn.execute(
+                f"UPDATE sheet_rows SET {assignments} WHERE spreadsheet_id = ? AND sheet = ? AND row_number = ?",
+                (*values, spreadsheet_id, sheet, row_number)
+            )
+        else:
+            self._conn.execute(
+                f"INSERT INTO sheet_rows (spreadsheet_id, sheet, row_number{''.join(', ' + col for col in columns)}) "
+                f"VALUES (?, ?, ?{', ?' * len(columns)})",
+                (spreadsheet_id, sheet, row_number, *values)
+            )
+
+    def append(self, spreadsheet_id, range_name, rows):
+        sheet, first_col, _, _, _ = parse_range(range_name)
+        with self._lock:
+            last_row = self._conn.execute(
+                "SELECT MAX(row_number) FROM sheet_rows WHERE spreadsheet_id = ? AND sheet = ?",
+                (spreadsheet_id, sheet)
+            ).fetchone()[0] or 0
+            for offset, values in enumerate(rows, start=1):
+                self._set_cells(spreadsheet_id, sheet, last_row + offset, first_col, values)
+            self._conn.commit()
+
+    def update(self, spreadsheet_id, range_name, rows):
+        sheet, first_col, first_row, _, _ = parse_range(range_name)
+        with self._lock:
+            for offset, values in enumerate(rows):
+                self._set_cells(spreadsheet_id, sheet, first_row + offset, first_col, values)
+            self._conn.commit()
+
+    def batch_update(self, spreadsheet_id, data):
+        with self._lock:
+            for update_range, values in data:
+                sheet, first_col, first_row, _, _ = parse_range(update_range)
+                self._set_cells(spreadsheet_id, sheet, first_row, first_col, values)
+            self._conn.commit()
+
+    def delete_rows(self, spreadsheet_id, range_name, row_numbers):
+        sheet = parse_range(range_name)[0]
+        row_numbers = sorted(set(row_numbers), reverse=True)
+        with self._lock:
+            for row_number in row_numbers:
+                self._conn.execute(
+                    "DELETE FROM sheet_rows WHERE spreadsheet_id = ? AND sheet = ? AND row_number = ?",
+                    (spreadsheet_id, sheet, row_number)
+                )
+                # Rows below move up, like deleteDimension does in Sheets
+                self._conn.execute(
+                    "UPDATE sheet_rows SET row_number = row_number - 1 "
+                    "WHERE spreadsheet_id = ? AND sheet = ? AND row_number > ?",
+                    (spreadsheet_id, sheet, row_number)
+                )
+            self._conn.commit()
+        return len(row_numbers)
+
+    def delete(self, spreadsheet_id, range_name, pairs):
+        # Same behaviour as SheetsStorage.delete, but found through the (user_id, word) index
+        sheet = parse_range(range_name)[0]
+        row_numbers = []
+        with self._lock:
+            for user_id, word in set(pairs):
+                row_numbers += [row[0] for row in self._conn.execute(
+                    "SELECT row_number FROM sheet_rows WHERE spreadsheet_id = ? AND b = ? AND c = ? AND sheet = ?",
+                    (spreadsheet_id, user_id, word, sheet)
+                )]
+        self.delete_rows(spreadsheet_id, range_name, row_numbers)
+        return sorted(row_numbers)
@@ -0,0 +1,184 @@
+import json
+import threading
+
+import pytest
+
+from append_buffer import AppendBuffer
+
+
+class Rejected(Exception):
+    pass
+
+
+class FakeSheet:
+    def __init__(self):
+        self.appends = []  # (spreadsheet_id, range_name, rows) per write
+        self.failures = []  # Exceptions raised by the next writes, in order
+
+    def write_rows(self, spreadsheet_id, range_name, rows):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.appends.append((spreadsheet_id, range_name, rows))
+
+
+def make_buffer(sheet, **kwargs):
+    # A long delay keeps the background thread out of the way; the tests flush themselves
+    kwargs.setdefault('max_delay', 60)
+    return AppendBuffer(sheet.write_rows, max_rows=1000, **kwargs)
+
+
+def test_flush_writes_each_run_of_rows_in_arrival_order():
+    sheet = FakeSheet()
+    buffer = make_buffer(sheet)
+    buffer.add('words', 'A:G', ['a'])
+    buffer.add('words', 'A:G', ['b'])
+    buffer.add('users', 'A:C', ['c'])
+    buffer.add('words', 'A:G', ['d'])
+
+    buffer.flush()
+
+    assert sheet.appends == [
+        ('words', 'A:G', [['a'], ['b']]),
+        ('users', 'A:C', [['c']]),
+        ('words', 'A:G', [['d']]),
+    ]
+    assert buffer.pending_count() == 0
+
+
+def test_flush_of_one_spreadsheet_leaves_the_others_queued():
+    sheet = FakeSheet()
+    buffer = make_buffer(sheet)
+    buffer.add('words', 'A:G', ['a'])
+    buffer.add('users', 'A:C', ['b'])
+
+    buffer.flush('words')
+
+    assert sheet.appends == [('words', 'A:G', [['a']])]
+    assert buffer.pending_count() == 1
+
+
+def test_failed_flush_requeues_unwritten_rows_in_front_and_in_order(tmp_path):
+    sheet = FakeSheet()
+    journal = tmp_path / 'journal.jsonl'
+    buffer = make_buffer(sheet, journal_path=str(journal))
+    buffer.add('words', 'A:G', ['a'])
+    buffer.add('users', 'A:C', ['b'])
+    buffer.add('words', 'A:G', ['c'])
+    sheet.failures = [ConnectionError('reset')]
+
+    # The first run fails, so nothing after it is written either
+    with pytest.raises(ConnectionError):
+        buffer.flush()
+    assert sheet.appends == []
+    assert buffer.pending_count() == 3
+    assert [json.loads(line)['row'] for line in journal.read_text().splitlines()] == [['a'], ['b'], ['c']]
+
+    buffer.add('words', 'A:G', ['d'])
+    buffer.flush(force=True)
+
+    assert sheet.appends == [
+        ('words', 'A:G', [['a']]),
+        ('users', 'A:C', [['b']]),
+        ('words', 'A:G', [['c'], ['d']]),
+    ]
+    assert journal.read_text() == ''
+
+
+def test_no_flush_is_attempted_during_backoff_unless_forced():
+    sheet = FakeSheet()
+    buffer = make_buffer(sheet, max_delay=30)
+    buffer.add('words', 'A:G', ['a'])
+    sheet.failures = [ConnectionError('reset')]
+    with pytest.raises(ConnectionError):
+        buffer.flush()
+
+    buffer.flush()
+    assert sheet.appends == []
+
+    buffer.flush(force=True)
+    assert sheet.appends == [('words', 'A:G', [['a']])]
+
+
+def test_rejected_rows_are_dead_lettered_and_the_rest_written(tmp_path):
+    sheet = FakeSheet()
+    dead_letter = tmp_path / 'dead_letter.jsonl'
+    dropped = []
+    buffer = make_buffer(
+        sheet,
+        is_permanent=lambda error: isinstance(error, Rejected),
+        dead_letter_path=str(dead_letter),
+        on_dead_letter=lambda spreadsheet_id, range_name, rows: dropped.append((spreadsheet_id, rows))
+    )
+    buffer.add('users', 'A:C', ['bad'])
+    buffer.add('words', 'A:G', ['a'])
+    sheet.failures = [Rejected('400 Bad Request')]
+
+    buffer.flush()
+
+    assert sheet.appends == [('words', 'A:G', [['a']])]
+    assert buffer.pending_count() == 0
+    assert buffer.dead_lettered == 1
+    assert dropped == [('users', [['bad']])]
+    assert json.loads(dead_letter.read_text())['row'] == ['bad']
+
+
+def test_journaled_rows_are_written_after_a_restart(tmp_path):
+    journal = tmp_path / 'journal.jsonl'
+    make_buffer(FakeSheet(), journal_path=str(journal)).add('words', 'A:G', ['a'])
+
+    sheet = FakeSheet()
+    make_buffer(sheet, journal_path=str(journal)).flush()
+
+    assert sheet.appends == [('words', 'A:G', [['a']])]
+
+
+def test_on_dead_letter_runs_after_the_flush_lock_is_released():
+    # A store reloading under its own lock waits for a flush; the callback must not hold one meanwhile
+    sheet = FakeSheet()
+    flushed_from_callback = []
+
+    def on_dead_letter(spreadsheet_id, range_name, rows):
+        other = threading.Thread(target=lambda: flushed_from_callback.append(buffer.flush() is None))
+        other.start()
+        other.join(timeout=5)
+
+    buffer = make_buffer(sheet, is_permanent=lambda error: isinstance(error, Rejected), on_dead_letter=on_dead_letter)
+    buffer.add('users', 'A:C', ['bad'])
+    sheet.failures = [Rejected('400 Bad Request')]
+
+    buffer.flush()
+
+    assert flushed_from_callback == [True]
+
+
+def test_pending_rows_are_returned_per_spreadsheet_until_written():
+    sheet = FakeSheet()
+    buffer = make_buffer(sheet)
+    buffer.add('users', 'A:C', ['a'])
+    buffer.add('words', 'A:G', ['b'])
+    buffer.add('users', 'A:C', ['c'])
+
+    assert buffer.pending_rows('users') == [['a'], ['c']]
+
+    buffer.flush('users')
+
+    assert buffer.pending_rows('users') == []
+    assert buffer.pending_rows('words') == [['b']]
+
+
+def test_paused_holds_off_flushes_from_other_threads_only():
+    sheet = FakeSheet()
+    buffer = make_buffer(sheet)
+    buffer.add('words', 'A:G', ['a'])
+
+    with buffer.paused():
+        other = threading.Thread(target=buffer.flush)
+        other.start()
+        other.join(timeout=0.2)
+        assert other.is_alive()
+        assert buffer.pending_rows('words') == [['a']]
+        buffer.add('words', 'A:G', ['b'])
+        buffer.flush()  # Same thread
+        assert sheet.appends == [('words', 'A:G', [['a'], ['b']])]
+    other.join(timeout=5)
+    assert not other.is_alive()
@@ -0,0 +1,51 @@
+from storage import SheetsStorage
+
+
+class FakeRequest:
+    def __init__(self, result=None):
+        self.result = result
+
+    def execute(self):
+        return self.result
+
+
+class FakeSpreadsheets:
+    def __init__(self):
+        self.batch_updates = []
+
+    def batchUpdate(self, spreadsheetId, body):
+        self.batch_updates.append(body)
+        return FakeRequest({})
+
+
+class FakeService:
+    def __init__(self):
+        self.sheets = FakeSpreadsheets()
+
+    def spreadsheets(self):
+        return self.sheets
+
+
+def deleted_ranges(body):
+    return [(request['deleteDimension']['range']['startIndex'], request['deleteDimension']['range']['endIndex'])
+            for request in body['requests']]
+
+
+def test_delete_rows_merges_adjacent_rows_into_one_request_each_bottom_up():
+    service = FakeService()
+    storage = SheetsStorage(lambda: service)
+
+    deleted = storage.delete_rows('words', 'シート1!A:G', [3, 9, 2, 10, 4, 7, 3])
+
+    assert deleted == 6
+    [body] = service.sheets.batch_updates
+    # 0-based, end-exclusive: rows 9-10, row 7, rows 2-4
+    assert deleted_ranges(body) == [(8, 10), (6, 7), (1, 4)]
+
+
+def test_delete_rows_without_rows_sends_nothing():
+    service = FakeService()
+    storage = SheetsStorage(lambda: service)
+
+    assert storage.delete_rows('words', 'シート1!A:G', []) == 0
+    assert service.sheets.batch_updates == []
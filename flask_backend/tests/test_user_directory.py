@@ -0,0 +1,70 @@
+from user_directory import UserDirectory
+
+
+class FakeUserSheet:
+    """Columns A:D of the user sheet, with the lookups UserDirectory uses to verify row numbers."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.loads = []  # first_row of every load
+
+    def load_rows(self, first_row):
+        self.loads.append(first_row)
+        return [list(row) for row in self.rows[first_row - 1:]]
+
+    def read_user_id(self, row_number):
+        row = self.rows[row_number - 1] if row_number <= len(self.rows) else []
+        return row[2] if len(row) > 2 else None
+
+    def find_user_row(self, user_id):
+        return next((index + 1 for index, row in enumerate(self.rows) if len(row) > 2 and row[2] == user_id), None)
+
+
+def make_directory(sheet):
+    return UserDirectory(sheet.load_rows, read_user_id=sheet.read_user_id, find_user_row=sheet.find_user_row)
+
+
+def test_verified_row_keeps_a_row_number_that_still_matches():
+    sheet = FakeUserSheet([['a@example.com', '', 'id-a'], ['b@example.com', '', 'id-b']])
+    directory = make_directory(sheet)
+    row_number, _ = directory.find_by_user_id('id-b')
+
+    assert directory.verified_row(row_number, 'id-b') == 2
+    assert sheet.loads == [1]
+
+
+def test_verified_row_finds_a_moved_row_again_and_reloads_on_next_use():
+    sheet = FakeUserSheet([['a@example.com', '', 'id-a'], ['b@example.com', '', 'id-b']])
+    directory = make_directory(sheet)
+    row_number, _ = directory.find_by_user_id('id-b')
+
+    sheet.rows.insert(0, ['inserted@example.com', '', 'id-x'])
+
+    assert directory.verified_row(row_number, 'id-b') == 3
+    assert directory.find_by_user_id('id-b')[0] == 3
+    assert sheet.loads == [1, 1]
+
+
+def test_verified_row_is_none_when_the_user_is_gone():
+    sheet = FakeUserSheet([['a@example.com', '', 'id-a'], ['b@example.com', '', 'id-b']])
+    directory = make_directory(sheet)
+    row_number, _ = directory.find_by_user_id('id-b')
+
+    del sheet.rows[1]
+
+    assert directory.verified_row(row_number, 'id-b') is None
+
+
+def test_refresh_reads_the_whole_sheet_while_appended_rows_are_still_queued():
+    sheet = FakeUserSheet([['a@example.com', '', 'id-a']])
+    queued = []
+    directory = UserDirectory(sheet.load_rows, has_pending=lambda: bool(queued))
+    directory.find_by_email('a@example.com')
+
+    # Our own row is still queued when another worker's row reaches the sheet
+    queued.append(['mine@example.com', '', 'id-mine'])
+    directory.append(queued[0])
+    sheet.rows.append(['other@example.com', '', 'id-other'])
+
+    assert directory.find_by_email('other@example.com')[0] == 2
+    assert sheet.loads == [1, 1]
@@ -0,0 +1,131 @@
+import threading
+
+from word_store import WordStore
+
+
+def make_store(rows):
+    store = WordStore(lambda: rows)
+    store.reload()
+    return store
+
+
+def words(store, user_id, since='', until=''):
+    return [record.word for _, record in store.user_rows(user_id, since, until)]
+
+
+ROWS = [
+    ['2024-05-03 09:00:00', 'u1', 'third'],
+    ['', 'u1', 'undated'],
+    ['2024/05/01 08:00:00', 'u1', 'first'],  # Reformatted by the sheet locale
+    ['2024-05-02 12:00:00', 'u2', 'other student'],
+    ['2024-05-02 12:00:00', 'u1', 'second'],
+    ['2024-05-04', 'u1', 'fourth'],
+]
+
+
+def test_user_rows_are_ordered_by_time_with_undated_rows_first():
+    store = make_store(ROWS)
+
+    assert words(store, 'u1') == ['undated', 'first', 'second', 'third', 'fourth']
+    assert [row_number for row_number, _ in store.user_rows('u1')] == [2, 3, 5, 1, 6]
+
+
+def test_since_and_until_are_inclusive_and_keep_undated_rows():
+    store = make_store(ROWS)
+
+    assert words(store, 'u1', since='2024-05-02 12:00:00') == ['undated', 'second', 'third', 'fourth']
+    assert words(store, 'u1', until='2024-05-02 12:00:00') == ['undated', 'first', 'second']
+    assert words(store, 'u1', since='2024-05-02 00:00:00', until='2024-05-03 23:59:59') == ['undated', 'second', 'third']
+
+
+def test_empty_window_still_returns_undated_rows():
+    store = make_store(ROWS)
+
+    assert words(store, 'u1', since='2024-06-01 00:00:00') == ['undated']
+    assert words(store, 'u1', since='2024-05-03 00:00:00', until='2024-05-02 00:00:00') == ['undated']
+    assert words(store, 'nobody', since='2024-05-01 00:00:00') == []
+
+
+def test_appended_rows_are_found_by_time_window():
+    store = make_store(ROWS)
+
+    store.append(['2024-05-02 18:00:00', 'u1', 'late second'])
+
+    assert words(store, 'u1', since='2024-05-02 00:00:00', until='2024-05-02 23:59:59') == ['undated', 'second', 'late second']
+    assert store.user_rows('u1', since='2024-05-02 18:00:00', until='2024-05-02 18:00:00')[-1][0] == 7
+
+
+class FakeWordSheet:
+    """Columns A:C of the word sheet, with the lookups WordStore uses to verify row numbers."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.loads = 0
+
+    def load_rows(self):
+        self.loads += 1
+        return [list(row) for row in self.rows]
+
+    def read_keys(self, row_numbers):
+        return [self.rows[row_number - 1][1:3] if row_number <= len(self.rows) else [] for row_number in row_numbers]
+
+    def find_rows(self, user_id, words):
+        return [(index + 1, row[2]) for index, row in enumerate(self.rows) if row[1] == user_id and row[2] in words]
+
+
+def make_verified_store(sheet):
+    store = WordStore(sheet.load_rows, read_keys=sheet.read_keys, find_rows=sheet.find_rows)
+    store.reload()
+    return store
+
+
+def test_verified_rows_keeps_row_numbers_that_still_match():
+    sheet = FakeWordSheet([['', 'u1', 'apple'], ['', 'u2', 'pear'], ['', 'u1', 'plum']])
+    store = make_verified_store(sheet)
+    rows = [(row_number, record.word) for row_number, record in store.user_rows('u1')]
+
+    assert store.verified_rows('u1', rows) == [(1, 'apple'), (3, 'plum')]
+    assert sheet.loads == 1
+
+
+def test_verified_rows_finds_moved_rows_again_and_reloads_on_next_use():
+    sheet = FakeWordSheet([['', 'u1', 'apple'], ['', 'u2', 'pear'], ['', 'u1', 'plum']])
+    store = make_verified_store(sheet)
+    rows = [(row_number, record.word) for row_number, record in store.user_rows('u1')]
+
+    sheet.rows.insert(0, ['', 'u3', 'inserted by hand'])
+
+    assert store.verified_rows('u1', rows) == [(2, 'apple'), (4, 'plum')]
+    assert [row_number for row_number, _ in store.user_rows('u1')] == [2, 4]
+    assert sheet.loads == 2
+
+
+def test_verified_rows_drops_rows_that_are_gone():
+    sheet = FakeWordSheet([['', 'u1', 'apple'], ['', 'u1', 'plum']])
+    store = make_verified_store(sheet)
+    rows = [(row_number, record.word) for row_number, record in store.user_rows('u1')]
+
+    del sheet.rows[0]
+
+    assert store.verified_rows('u1', rows) == [(1, 'plum')]
+
+
+def test_load_does_not_hold_the_store_lock_and_rereads_after_a_concurrent_change():
+    rows = [['', 'u1', 'apple']]
+    loads = []
+
+    def load_rows():
+        loads.append(len(rows))
+        if len(loads) == 1:
+            # Another thread changes the store while the sheet is being read
+            other = threading.Thread(target=lambda: (rows.append(['', 'u1', 'plum']), store.append(['', 'u1', 'plum'])))
+            other.start()
+            other.join(timeout=5)
+            assert not other.is_alive()
+            return [['', 'u1', 'apple']]
+        return [list(row) for row in rows]
+
+    store = WordStore(load_rows)
+
+    assert words(store, 'u1') == ['apple', 'plum']
+    assert loads == [1, 2]
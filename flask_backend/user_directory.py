@@ -0,0 +1,156 @@
+import threading
+import time
+
+LOAD_ATTEMPTS = 3  # Loads that raced with a write are read again this many times at most
+
+
+class UserDirectory:
+    """In-process copy of the user sheet (email, '', user_id, nickname) with hash indexes."""
+
+    def __init__(self, load_rows, ttl=300, read_user_id=None, find_user_row=None, has_pending=None):
+        # load_rows(first_row) must return the sheet rows starting at sheet row first_row
+        self._load_rows = load_rows
+        # has_pending() tells whether rows appended here are still waiting to reach the sheet; row
+        # numbers past the sheet's end are then unknown, so refresh reads everything instead
+        self._has_pending = has_pending or (lambda: False)
+        # read_user_id(row_number) returns the user_id cell of that sheet row, and
+        # find_user_row(user_id) searches the sheet for the row number holding user_id
+        self._read_user_id = read_user_id
+        self._find_user_row = find_user_row
+        self._ttl = ttl
+        self._lock = threading.RLock()
+        # Serializes loads. The sheet is read holding only this lock, never self._lock: reading
+        # flushes the append buffer, which may call invalidate() from another thread
+        self._load_lock = threading.Lock()
+        self._rows = None  # self._rows[i] is sheet row i+1
+        self._by_email = {}  # email -> position in self._rows
+        self._by_user_id = {}  # user_id -> position in self._rows
+        self._loaded_at = 0
+        self._version = 0  # Bumped by every change, so a load that overlapped one is read again
+
+    def _index(self, index):
+        row = self._rows[index]
+        # Keep the first occurrence, like the old top-to-bottom scans did
+        if len(row) > 0:
+            self._by_email.setdefault(row[0], index)
+        if len(row) > 2:
+            self._by_user_id.setdefault(row[2], index)
+
+    def invalidate(self):
+        # The sheet changed behind our back (e.g. rows edited by hand): load it again on next use
+        with self._lock:
+            self._rows = None
+            self._version += 1
+
+    def _stale(self):
+        with self._lock:
+            return self._rows is None or time.monotonic() - self._loaded_at > self._ttl
+
+    def _ensure_loaded(self):
+        if self._stale():
+            with self._load_lock:
+                if self._stale():  # Another thread may have loaded it while we waited
+                    self._load()
+
+    def reload(self):
+        with self._load_lock:
+            self._load()
+
+    def _load(self):
+        for attempt in range(LOAD_ATTEMPTS):
+            with self._lock:
+                version = self._version
+            rows = [list(row) for row in self._load_rows(1)]
+            with self._lock:
+                if self._version == version or attempt == LOAD_ATTEMPTS - 1:
+                    self._rows = rows
+                    self._by_email = {}
+                    self._by_user_id = {}
+                    for index in range(len(self._rows)):
+                        self._index(index)
+                    # Rows read while writes kept landing may miss one, so read again on next use
+                    self._loaded_at = time.monotonic() if self._version == version else 0
+                    self._version += 1
+                    return
+
+    def refresh(self):
+        # Only read the rows appended since the last load (e.g. by another worker)
+        with self._load_lock:
+            with self._lock:
+                loaded = self._rows is not None and not self._has_pending()
+                if loaded:
+                    version = self._version
+                    first_row = len(self._rows) + 1
+            if not loaded:
+                self._load()
+                return
+            rows = self._load_rows(first_row)
+            with self._lock:
+                if self._version == version:
+                    for row in rows:
+                        self._rows.append(list(row))
+                        self._index(len(self._rows) - 1)
+                    return
+            # The directory changed while reading, so first_row may be off: read it all
+            self._load()
+
+    def _lookup(self, index_name, key):
+        while True:
+            self._ensure_loaded()
+            with self._lock:
+                if self._rows is not None:  # Unless invalidated in between
+                    index = getattr(self, index_name).get(key)
+                    return (None, None) if index is None else (index + 1, list(self._rows[index]))
+
+    def _find(self, index_name, key):
+        row_number, row = self._lookup(index_name, key)
+        if row_number is None:
+            self.refresh()
+            row_number, row = self._lookup(index_name, key)
+        return row_number, row
+
+    def find_by_email(self, email):
+        """Returns (sheet_row_number, row) or (None, None)."""
+        return self._find('_by_email', email)
+
+    def find_by_user_id(self, user_id):
+        """Returns (sheet_row_number, row) or (None, None)."""
+        return self._find('_by_user_id', user_id)
+
+    def verified_row(self, row_number, user_id):
+        """Checks a row number from find_by_user_id against the sheet before writing to it.
+
+        If the row moved (rows inserted or removed by hand), it is found again with find_user_row
+        and the directory is reloaded on next use. Returns None if user_id is gone.
+        """
+        if self._read_user_id is None or self._read_user_id(row_number) == user_id:
+            return row_number
+        self.invalidate()
+        return self._find_user_row(user_id)
+
+    def rows_for_emails(self, emails):
+        """Returns [(sheet_row_number, row), ...] in sheet order for the given emails."""
+        while True:
+            self._ensure_loaded()
+            with self._lock:
+                if self._rows is not None:
+                    found = sorted({self._by_email[email] for email in emails if email in self._by_email})
+                    return [(index + 1, list(self._rows[index])) for index in found]
+
+    def append(self, row):
+        with self._lock:
+            self._version += 1  # Also makes a load in progress read the sheet again
+            if self._rows is None:
+                return  # The next load will read the row from the sheet
+            self._rows.append(list(row))
+            self._index(len(self._rows) - 1)
+
+    def set_nickname(self, row_number, nickname):
+        with self._lock:
+            self._version += 1
+            if self._rows is None or row_number > len(self._rows):
+                return
+            row = self._rows[row_number - 1]
+            if len(row) < 4:
+                row.extend([''] * (4 - len(row)))
+            row[3] = nickname
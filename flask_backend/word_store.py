@@ -0,0 +1,210 @@
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+
+FIELDS = ('added_at', 'user_id', 'word', 'pronunciation', 'definition', 'synonyms', 'examples')  # columns A:G
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+LOAD_ATTEMPTS = 3  # Loads that raced with a write are read again this many times at most
+# Sheets reformats the timestamps it parses, depending on the spreadsheet locale
+READ_FORMATS = (TIMESTAMP_FORMAT, '%Y/%m/%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y/%m/%d %H:%M', '%Y-%m-%d', '%Y/%m/%d')
+
+
+def normalize_timestamp(value):
+    """Returns value as 'YYYY-MM-DD HH:MM:SS', or '' for rows added before timestamps were written."""
+    value = value.strip()
+    for fmt in READ_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime(TIMESTAMP_FORMAT)
+        except ValueError:
+            pass
+    return ''
+
+
+class WordRecord:
+    """One row of the word sheet. Slots keep 100k of these far smaller than lists of cells."""
+
+    __slots__ = FIELDS
+
+    def __init__(self, added_at='', user_id='', word='', pronunciation='', definition='', synonyms='', examples=''):
+        self.added_at = normalize_timestamp(added_at) if added_at else ''
+        # The same few user_ids and many repeated words are shared instead of copied per row
+        self.user_id = sys.intern(user_id)
+        self.word = sys.intern(word)
+        self.pronunciation = pronunciation
+        self.definition = definition
+        self.synonyms = synonyms
+        self.examples = examples
+
+    @classmethod
+    def from_row(cls, row):
+        # Sheet rows come back without their trailing empty cells
+        return cls(*(str(cell) for cell in row[:len(FIELDS)]))
+
+    def replaced(self, start_column, values):
+        # start_column is 0-based, e.g. 3 for column D
+        cells = [getattr(self, field) for field in FIELDS]
+        cells[start_column:start_column + len(values)] = values
+        return WordRecord(*cells[:len(FIELDS)])
+
+    def missing_content(self):
+        return bool(self.word) and not (self.pronunciation and self.definition and self.synonyms)
+
+    def to_dict(self):
+        # Built only when a response is serialized
+        return {
+            "added_at": self.added_at,
+            "word": self.word,
+            "pronunciation": self.pronunciation,
+            "definition": self.definition,
+            "synonyms": self.synonyms,
+            "examples": self.examples
+        }
+
+
+class WordStore:
+    """In-process copy of the vocabulary sheet, indexed by user_id."""
+
+    def __init__(self, load_rows, ttl=300, read_keys=None, find_rows=None):
+        # load_rows() must return every row of the word sheet in sheet order
+        self._load_rows = load_rows
+        # read_keys(row_numbers) returns the [user_id, word] cells of those sheet rows, and
+        # find_rows(user_id, words) searches the sheet for [(row_number, word), ...]
+        self._read_keys = read_keys
+        self._find_rows = find_rows
+        self._ttl = ttl
+        self._lock = threading.RLock()
+        # Serializes loads. The sheet is read holding only this lock, never self._lock: reading
+        # flushes the append buffer, which may call invalidate() from another thread
+        self._load_lock = threading.Lock()
+        self._rows = None  # WordRecords, self._rows[i] is sheet row i+1
+        self._by_user = {}  # user_id -> array of positions in self._rows, ordered by (added_at, position)
+        self._loaded_at = 0
+        self._version = 0  # Bumped by every change, so a load that overlapped one is read again
+
+    def invalidate(self):
+        # The sheet changed behind our back (e.g. rows edited by hand): load it again on next use
+        with self._lock:
+            self._rows = None
+            self._version += 1
+
+    def _stale(self):
+        with self._lock:
+            return self._rows is None or time.monotonic() - self._loaded_at > self._ttl
+
+    def _ensure_loaded(self):
+        # Reload now and then so manual edits in the sheet eventually show up
+        if self._stale():
+            with self._load_lock:
+                if self._stale():  # Another thread may have loaded it while we waited
+                    self._load()
+
+    def _added_at(self, index):
+        return self._rows[index].added_at
+
+    def _reindex(self):
+        by_user = {}
+        for index, record in enumerate(self._rows):
+            if record.user_id:
+                by_user.setdefault(record.user_id, []).append(index)
+        # Undated rows sort first, then by time; ties keep sheet order
+        self._by_user = {
+            user_id: array('I', sorted(positions, key=lambda index: (self._rows[index].added_at, index)))
+            for user_id, positions in by_user.items()
+        }
+
+    def reload(self):
+        with self._load_lock:
+            self._load()
+
+    def _load(self):
+        for attempt in range(LOAD_ATTEMPTS):
+            with self._lock:
+                version = self._version
+            rows = [WordRecord.from_row(row) for row in self._load_rows()]
+            with self._lock:
+                if self._version == version or attempt == LOAD_ATTEMPTS - 1:
+                    self._rows = rows
+                    self._reindex()
+                    # Rows read while writes kept landing may miss one, so read again on next use
+                    self._loaded_at = time.monotonic() if self._version == version else 0
+                    self._version += 1
+                    return
+
+    def user_rows(self, user_id, since='', until=''):
+        """Returns [(sheet_row_number, WordRecord), ...] for user_id, oldest first.
+
+        since/until are inclusive 'YYYY-MM-DD HH:MM:SS' bounds; undated rows are always included.
+        """
+        while True:
+            self._ensure_loaded()
+            with self._lock:
+                if self._rows is not None:  # Unless invalidated in between
+                    return self._user_rows(user_id, since, until)
+
+    def _user_rows(self, user_id, since, until):
+        # Called with self._lock held
+        positions = self._by_user.get(user_id, ())
+        if since or until:
+            undated = bisect_right(positions, '', key=self._added_at)
+            start = max(undated, bisect_left(positions, since, key=self._added_at)) if since else undated
+            end = bisect_right(positions, until, key=self._added_at) if until else len(positions)
+            positions = positions[:undated] + positions[start:max(start, end)]
+        # Records are replaced rather than changed in place, so they can be handed out as they are
+        return [(index + 1, self._rows[index]) for index in positions]
+
+    def verified_rows(self, user_id, rows):
+        """Checks [(row_number, word), ...] from user_rows against the sheet before writing to them.
+
+        Row numbers can be up to ttl seconds old; rows that moved since (inserted or removed by hand,
+        or by another worker) are found again with find_rows, and the store is reloaded on next use.
+        """
+        if not rows or self._read_keys is None:
+            return rows
+        if all(cells == [user_id, word] for (_, word), cells in zip(rows, self._read_keys([row_number for row_number, _ in rows]))):
+            return rows
+        self.invalidate()
+        return self._find_rows(user_id, {word for _, word in rows})
+
+    def total_rows(self):
+        while True:
+            self._ensure_loaded()
+            with self._lock:
+                if self._rows is not None:
+                    return len(self._rows)
+
+    def append(self, row):
+        with self._lock:
+            self._version += 1  # Also makes a load in progress read the sheet again
+            if self._rows is None:
+                return  # Not loaded yet, the next load will read the row from the sheet
+            record = WordRecord.from_row(row)
+            self._rows.append(record)
+            if record.user_id:
+                positions = self._by_user.setdefault(record.user_id, array('I'))
+                insort(positions, len(self._rows) - 1, key=lambda index: (self._rows[index].added_at, index))
+
+    def update(self, row_number, start_column, values):
+        # start_column is 0-based, e.g. 3 for column D
+        with self._lock:
+            self._version += 1
+            if self._rows is None or row_number > len(self._rows):
+                return
+            self._rows[row_number - 1] = self._rows[row_number - 1].replaced(start_column, values)
+            if start_column == 0:
+                self._reindex()  # The timestamp or owner may have changed
+
+    def delete_words(self, user_id, words):
+        """Mirrors sheet_operation("delete"), which removes every matching row; returns their row numbers."""
+        words = set(words)
+        with self._lock:
+            self._version += 1
+            if self._rows is None:
+                return None
+            doomed = {index for index in self._by_user.get(user_id, ()) if self._rows[index].word in words}
+            if doomed:
+                self._rows = [record for index, record in enumerate(self._rows) if index not in doomed]
+                self._reindex()
+            return sorted(index + 1 for index in doomed)
@@ -0,0 +1,72 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import streamlit as st
+
+# Evaluations of identical answers are reused for this many seconds; at most this many are kept
+EVALUATION_CACHE_TTL = 7 * 24 * 3600
+EVALUATION_CACHE_MAX_ENTRIES = 2000
+
+
+def normalize_answer(text):
+    # Resubmissions often differ only in spacing or line breaks
+    return ' '.join(text.split())
+
+
+class EvaluationCache:
+    """Assistant evaluations keyed by a hash of what was evaluated, with a TTL and a size limit."""
+
+    def __init__(self, ttl=86400, max_entries=1000):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (stored_at, evaluation), least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(assistant_id, framework, section, answer):
+        # The answer text already starts with the question when one was given
+        fields = (assistant_id, framework, section, normalize_answer(answer))
+        return hashlib.sha256('\x1f'.join(str(field) for field in fields).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self._ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, evaluation):
+        with self._lock:
+            self._entries[key] = (time.time(), evaluation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+@st.cache_resource
+def get_evaluation_cache():
+    # One cache for every session in the process, so the Admin Panel sees the same counters
+    return EvaluationCache(ttl=EVALUATION_CACHE_TTL, max_entries=EVALUATION_CACHE_MAX_ENTRIES)
@@ -3,6 +3,9 @@ import matplotlib.pyplot as plt
 import pandas as pd
 import pytz
 import requests
+import json
+import random
+import time
 from datetime import datetime, timedelta
 
 def todays_total_submissions(data):
@@ -120,20 +123,67 @@ def filters(filtered_data, apply_email_filter=True):
     
 
 
+def with_backoff(fn, retries=5, base_delay=1.0, statuses=(429, 500, 502, 503, 504)):
+    # Retries Google Sheets quota (429) and server (5xx) errors with jittered exponential backoff
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            if status not in statuses or attempt == retries:
+                raise
+            time.sleep(random.uniform(0, base_delay * 2 ** attempt))
+
+
 # ----------------- VOCABREVIEW -------------------
-    
-def fetch_table_content(user_id, JP):
-    request_url = f'https://wernicke-backend.onrender.com/get_words?user_id={user_id}'
+
+def recent_since(days=7):
+    # Start of the vocabulary window shown to students and teachers, as a Japan date
+    return (datetime.now(pytz.timezone('Asia/Tokyo')) - timedelta(days=days)).strftime('%Y-%m-%d')
+
+
+def request_with_etag(method, url, **kwargs):
+    # Sends the ETag of the last answer to the same request; on 304 the stored body is reused
+    cache = st.session_state.setdefault('etag_cache', {})
+    key = (method, url, json.dumps(kwargs, sort_keys=True))
+    cached = cache.get(key)
+    headers = {'If-None-Match': cached[0]} if cached else {}
+    response = requests.request(method, url, headers=headers, **kwargs)  # Compressed bodies are decoded by requests
+    if response.status_code == 304 and cached:
+        return cached[1]
+    response.raise_for_status()  # Will raise an exception for HTTP errors
+    data = response.json()
+    if response.headers.get('ETag'):
+        cache[key] = (response.headers['ETag'], data)
+    return data
+
+
+def fetch_table_content(user_id, JP, since=None):
+    request_url = 'https://wernicke-backend.onrender.com/get_words'
+    params = {'user_id': user_id}
+    if since:
+        params['since'] = since  # Words added before this date are left out (undated old words are kept)
     try:
-        response = requests.get(request_url)
-        response.raise_for_status()  # Will raise an exception for HTTP errors
         # Directly return the JSON response since it's already the list of word details
-        return response.json()
+        return request_with_etag('GET', request_url, params=params)
     except requests.RequestException as e:
         st.error(f'Failed to retrieve word details: {e}')
         return []
     
 
+def fetch_words_bulk(user_ids, since=None):
+    # One request for every selected student instead of one /get_words call each
+    request_url = 'https://wernicke-backend.onrender.com/get_words_bulk'
+    payload = {'user_ids': user_ids}
+    if since:
+        payload['since'] = since
+    try:
+        return request_with_etag('POST', request_url, json=payload)  # Maps each user_id to its list of word details
+    except requests.RequestException as e:
+        st.error(f'Failed to retrieve word details: {e}')
+        return {}
+    
+
 def make_request(endpoint, json_data):
     base_url = 'https://wernicke-backend.onrender.com'
     request_url = f'{base_url}/{endpoint}'
@@ -0,0 +1,107 @@
+import io
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import streamlit as st
+
+TARGET_RATE = 16000  # Whisper works at 16 kHz mono, anything above is wasted upload; lower rates are kept
+CHUNK_SECONDS = 60  # Recordings longer than this are split and transcribed in parallel
+SILENCE_SEARCH_SECONDS = 10  # How far before each chunk end to look for a pause to cut at
+FRAME_SECONDS = 0.03  # Loudness is measured over frames of this length
+MAX_WORKERS = 4
+TRANSCRIPT_CACHE_TTL = 7 * 24 * 3600
+TRANSCRIPT_CACHE_MAX_ENTRIES = 500
+
+
+def read_wav(data):
+    """Returns (mono float32 samples, sample rate), or None if data is not PCM WAV."""
+    try:
+        with wave.open(io.BytesIO(data)) as wav:
+            channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype='<i2').astype(np.float32) / 2 ** 15
+    elif width == 3:
+        # 24-bit: widen each sample to 32 bits, keeping the sign in the top byte
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+        padded = np.zeros((len(raw), 4), dtype=np.uint8)
+        padded[:, 1:] = raw
+        samples = padded.view('<i4').ravel().astype(np.float32) / 2 ** 31
+    elif width == 4:
+        samples = np.frombuffer(frames, dtype='<i4').astype(np.float32) / 2 ** 31
+    else:
+        return None
+    samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1)
+    return samples, rate
+
+
+def resample(samples, rate, target_rate=TARGET_RATE):
+    """Returns (samples, rate), downsampled to target_rate; lower rates, e.g. 8 kHz phone recordings, are kept."""
+    if rate <= target_rate or not len(samples):
+        return samples, rate
+    # Average over the span each output sample covers, so higher frequencies don't alias
+    width = rate // target_rate
+    if width > 1:
+        samples = np.convolve(samples, np.ones(width, dtype=np.float32) / width, mode='same')
+    duration = len(samples) / rate
+    positions = np.arange(int(duration * target_rate)) * (rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32), target_rate
+
+
+def encode_wav(samples, rate=TARGET_RATE):
+    pcm = (np.clip(samples, -1, 1) * (2 ** 15 - 1)).astype('<i2')
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+
+def split_at_silence(samples, rate=TARGET_RATE, chunk_seconds=CHUNK_SECONDS):
+    """Cuts samples into pieces of at most chunk_seconds, each ending at the quietest frame near its end."""
+    frame = max(1, int(FRAME_SECONDS * rate))
+    chunk, search = int(chunk_seconds * rate), int(SILENCE_SEARCH_SECONDS * rate)
+    chunks, start = [], 0
+    while len(samples) - start > chunk:
+        window_start = start + chunk - search
+        window = samples[window_start:start + chunk]
+        usable = len(window) - len(window) % frame
+        loudness = np.sqrt((window[:usable].reshape(-1, frame) ** 2).mean(axis=1))
+        end = window_start + int(loudness.argmin()) * frame + frame // 2
+        chunks.append(samples[start:end])
+        start = end
+    chunks.append(samples[start:])
+    return chunks
+
+
+def prepare_audio(data, file_name):
+    """Returns [(file_name, bytes), ...] to transcribe in order; anything but PCM WAV is passed through."""
+    decoded = read_wav(data)
+    if decoded is None:
+        return [(file_name, data)]
+    samples, rate = resample(*decoded)
+    return [(f"chunk{i}.wav", encode_wav(chunk, rate)) for i, chunk in enumerate(split_at_silence(samples, rate))]
+
+
+@st.cache_data(ttl=TRANSCRIPT_CACHE_TTL, max_entries=TRANSCRIPT_CACHE_MAX_ENTRIES, show_spinner=False)
+def transcribe_audio(_client, data, _file_name):
+    """Transcript of an uploaded recording; cached by the content of data, so the same audio is only sent to Whisper once."""
+    def transcribe(upload):
+        return _client.audio.transcriptions.create(
+            model="whisper-1",
+            file=upload,
+            response_format="text"
+        ).strip()
+
+    uploads = prepare_audio(data, _file_name)
+    if len(uploads) == 1:
+        return transcribe(uploads[0])
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(uploads))) as executor:
+        return " ".join(text for text in executor.map(transcribe, uploads) if text)
@@ -4,6 +4,7 @@ import requests
 import pandas as pd
 import time
 from Home import add_bottom, translate
+from modules.modules import recent_since, fetch_table_content
 
 st.set_page_config(
     page_title = "Vocabulary Review",
@@ -119,23 +120,14 @@ def fill_missing_content_for_user(user_id):
             data = response.json()
             if data.get('result') == 'success':
                 st.success(f'Missing content filled for {data.get("updated")} words.')
-            else:
+            elif data.get('result') == 'no updates needed':
                 st.info('No missing content needed to be filled.')
+            if data.get('failed'):
+                st.warning(f'Could not fill content for: {", ".join(data["failed"])}. Please try again later.')
         else:
             st.error('Failed to fill missing content due to an error.')
 
 
-def fetch_table_content(user_id, JP):
-    request_url = f'https://wernicke-backend.onrender.com/get_words?user_id={user_id}'
-    try:
-        response = requests.get(request_url)
-        response.raise_for_status()  # Will raise an exception for HTTP errors
-        # Directly return the JSON response since it's already the list of word details
-        return response.json()
-    except requests.RequestException as e:
-        st.error(f'Failed to retrieve word details: {e}')
-        return []
-
 def activate_chatbot():
     st.session_state.chatbot_active = True
 
@@ -161,7 +153,7 @@ def make_request(endpoint, json_data):
     request_url = f'{base_url}/{endpoint}'
     response = requests.post(request_url, json=json_data)
     if response.status_code == 200:
-        return True
+        return response.json()  # Non-empty dict, so callers can still use it as True
     else:
         st.error(f'Status code: {response.status_code}')
         return False
@@ -171,8 +163,11 @@ def add_word_form():
         added_word = st.text_input("Enter a word to add 👇", key="add_word_input")
         submit_add = st.form_submit_button("Add Word")
         if submit_add and added_word.strip():
-            if make_request("add_word", {'user_id': st.query_params['user'], 'word': added_word}):
+            result = make_request("add_word", {'user_id': st.query_params['user'], 'word': added_word})
+            if result:
                 st.session_state['added_success'] = True
+                if result.get('job_id'):
+                    st.session_state['enrichment_job'] = {'id': result['job_id'], 'word': added_word}
                 st.session_state.chatbot_active = False
                 st.rerun()
             else:
@@ -204,6 +199,26 @@ def delete_word_form():
         st.success("Word deleted successfully!")
         st.session_state['deleted_success'] = False
 
+def show_enrichment_status(JP):
+    # add_word returns before the definition is ready, so check on the background job
+    job = st.session_state.get('enrichment_job')
+    if not job:
+        return
+    try:
+        response = requests.get(f'https://wernicke-backend.onrender.com/jobs/{job["id"]}')
+        status = response.json().get('status') if response.ok else None
+    except requests.RequestException:
+        status = None
+
+    if status in ('queued', 'running'):
+        st.info(translate(f"「{job['word']}」の詳細を取得中です...", f"Looking up the details of '{job['word']}'...", JP))
+        st.button(translate("更新", "Refresh", JP), key="refresh_enrichment")
+    else:
+        if status == 'failed':
+            st.warning(translate(f"「{job['word']}」の詳細を取得できませんでした。'Fill Missing Content'をお試しください。",
+                                 f"Could not look up '{job['word']}'. Please try 'Fill Missing Content'.", JP))
+        del st.session_state['enrichment_job']
+
 @st.cache_data(ttl="1m")
 def check_nickname(user_id):
     response = requests.post('https://wernicke-backend.onrender.com/check_nickname', json={'user_id': user_id})
@@ -256,7 +271,8 @@ def main():
         st.write("User authenticated!") #might faster the app
         nickname = check_nickname(st.query_params.user)
         if nickname is not None:
-            table_content = fetch_table_content(st.query_params.user, JP)
+            show_enrichment_status(JP)
+            table_content = fetch_table_content(st.query_params.user, JP, since=recent_since())  # This week's words only
             if table_content:
                 tab1, tab2= st.tabs(["🏆 Words", "📕 Dictionary"])
 
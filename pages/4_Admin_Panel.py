@@ -7,7 +7,8 @@ import numpy as np
 import json
 import re
 import requests
-from modules.modules import todays_total_submissions, plot_recent_submissions, filters, fetch_table_content #, make_request
+from modules.modules import todays_total_submissions, plot_recent_submissions, filters, fetch_words_bulk, recent_since #, make_request
+from modules.evaluation_cache import get_evaluation_cache
 
 
 st.set_page_config(
@@ -107,6 +108,15 @@ def display_data_and_metrics(filtered_data):
         email_filtered_data = filtered_data[filtered_data['user_email'] == email]
         display_progression_graph(email_filtered_data, JP=True, score_column=6)
 
+def evaluation_cache_metrics():
+    # Counters since the app process started; every hit is an assistant run that was skipped
+    stats = get_evaluation_cache().stats()
+    st.header("Evaluation Cache")
+    cl1, cl2, cl3 = st.columns(3)
+    cl1.metric(label="Reused evaluations", value=stats['hits'], delta=f"{stats['hit_rate']:.0%} of submissions")
+    cl2.metric(label="New evaluations", value=stats['misses'])
+    cl3.metric(label="Cached answers", value=stats['entries'], delta=f"{stats['evictions']} evicted", delta_color="off")
+
 def summarize_feedback(filtered_data):
     # Regex patterns for each section
     patterns = {
@@ -212,6 +222,7 @@ def main():
 
         # Display the filtered data and metrics
         display_data_and_metrics(filtered_data)
+        evaluation_cache_metrics()
     with tab2:
         st.subheader("Student's Vocabulary Practice")
 
@@ -225,13 +236,11 @@ def main():
         # Initialize an empty list to collect words from all selected students
         all_words = []
         if selected_nicknames:
-            all_user_ids = []
-            for nickname in selected_nicknames:  # Iterate over each selected nickname
-                user_id = nicknames_with_ids[nickname]  # Directly access the user_id for the current nickname
-                table_content = fetch_table_content(user_id, JP)  # Fetch words for the user_id
-                words = [word['word'] for word in table_content]  # Extract words from the table content
+            all_user_ids = [nicknames_with_ids[nickname] for nickname in selected_nicknames]
+            words_by_user = fetch_words_bulk(all_user_ids, since=recent_since())  # This week's words of every selected student at once
+            for user_id in all_user_ids:
+                words = [word['word'] for word in words_by_user.get(user_id, [])]  # Extract words from the table content
                 all_words.extend(words)
-                all_user_ids.extend(user_id)
 
             display_words(all_words, JP)
 